@@ -8,11 +8,12 @@ Usage:
 
 import sys
 from dotenv import load_dotenv
-load_dotenv()
-
-from src.indexer import run_full_index, run_incremental_update
 
 if __name__ == '__main__':
+    # src.config reads the environment at import time, so load .env first
+    load_dotenv()
+    from src.indexer import run_full_index, run_incremental_update
+
     if '--update' in sys.argv:
         run_incremental_update()
     else:
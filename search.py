@@ -17,16 +17,14 @@ type a new query to search again, or 'q' to quit.
 """
 
 import argparse
-import os
 import re
-import subprocess
 import sys
 
 from dotenv import load_dotenv
-load_dotenv()
 
-from src.search_pipeline import init_pipeline, run_search
-from src.vectordb import get_index_stats
+from src.url_opener import open_url
+
+_OPEN_COMMAND_RE = re.compile(r'^(?:open\s+)?(\d+)$', re.IGNORECASE)
 
 
 def format_results(results, query_str):
@@ -67,13 +65,14 @@ def format_results(results, query_str):
         if len(text) > 600:
             preview += '...'
 
-        lines.append(f"[{i}] {title}")
-        lines.append(f"    {authors} ({date}) -- {item_type}{page_str}")
-        lines.append(f"    {score_str}")
-        if archive_info:
-            lines.append(f"   {archive_info}")
-        lines.append(f"    {preview}")
-        lines.append("")
+        archive_line = f"   {archive_info}\n" if archive_info else ''
+        lines.append(
+            f"[{i}] {title}\n"
+            f"    {authors} ({date}) -- {item_type}{page_str}\n"
+            f"    {score_str}\n"
+            f"{archive_line}"
+            f"    {preview}\n"
+        )
 
     return '\n'.join(lines)
 
@@ -99,12 +98,7 @@ def open_result(results, number):
         print("No Zotero key for this result.")
         return
 
-    if sys.platform == "darwin":
-        subprocess.Popen(['open', url])
-    elif sys.platform.startswith("linux"):
-        subprocess.Popen(['xdg-open', url])
-    elif sys.platform == "win32":
-        os.startfile(url)
+    open_url(url)
     print(f"Opened in Zotero: {url}")
 
 
@@ -118,18 +112,26 @@ def main():
     parser.add_argument('--stats', action='store_true', help='Show index stats and exit')
     args = parser.parse_args()
 
-    print("Initializing...", end=' ', flush=True)
-    init_pipeline()
-    print("done.")
+    if not args.stats and not args.query:
+        parser.print_help()
+        return
+
+    # src.config reads the environment at import time, so load .env first
+    # and import the pipeline only once we know it is needed
+    load_dotenv()
 
     if args.stats:
+        from src.vectordb import init_pinecone, get_index_stats
+        init_pinecone()
         stats = get_index_stats()
         print(f"Index: {stats.total_vector_count} vectors")
         return
 
-    if not args.query:
-        parser.print_help()
-        return
+    from src.search_pipeline import init_pipeline, run_search
+
+    print("Initializing...", end=' ', flush=True)
+    init_pipeline()
+    print("done.")
 
     query_str = ' '.join(args.query)
     results = run_search(query_str, top_k=args.top)
@@ -145,7 +147,7 @@ def main():
                 break
             if not cmd or cmd.lower() in ('q', 'quit', 'exit'):
                 break
-            m = re.match(r'^(?:open\s+)?(\d+)$', cmd, re.IGNORECASE)
+            m = _OPEN_COMMAND_RE.match(cmd)
             if m:
                 open_result(results, int(m.group(1)))
                 continue
@@ -6,11 +6,8 @@ Integrates with Claude Desktop for natural language search over your Zotero libr
 
 import json
 import logging
-import os
-import subprocess
-import sys
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from typing import Optional
 from urllib.parse import urlparse, parse_qs
 
@@ -21,6 +18,7 @@ from mcp.server.fastmcp import FastMCP
 
 from src.search_pipeline import init_pipeline, run_search, get_archive_aliases
 from src.vectordb import get_index_stats
+from src.url_opener import open_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,6 +29,15 @@ LINK_SERVER_PORT = 19285
 
 _last_results = []
 
+_FORMATTING_RULES = (
+    "FORMATTING RULES:\n"
+    "1. Write citations as [[N]](url) using the link from each source.\n"
+    "2. At the END of your response, copy the SOURCES block below as-is.\n"
+    "3. Be neutral and professional.\n\n"
+)
+
+_SOURCES_HEADER = "\n---\nSOURCES (copy this block verbatim at the end of your response):\n\n"
+
 
 class _ZoteroLinkHandler(BaseHTTPRequestHandler):
     """Handles localhost requests by opening zotero:// URLs."""
@@ -50,18 +57,15 @@ class _ZoteroLinkHandler(BaseHTTPRequestHandler):
             url = f"zotero://select/library/items/{key}"
         else:
             self.send_response(404)
+            self.send_header('Connection', 'close')
             self.end_headers()
             return
 
-        if sys.platform == "darwin":
-            subprocess.Popen(['open', url])
-        elif sys.platform.startswith("linux"):
-            subprocess.Popen(['xdg-open', url])
-        elif sys.platform == "win32":
-            os.startfile(url)
+        open_url(url)
 
         self.send_response(200)
         self.send_header('Content-Type', 'text/html')
+        self.send_header('Connection', 'close')
         self.end_headers()
         self.wfile.write(b'<html><body><p>Opened in Zotero.</p>'
                          b'<script>window.close()</script></body></html>')
@@ -71,9 +75,13 @@ class _ZoteroLinkHandler(BaseHTTPRequestHandler):
 
 
 def _start_link_server():
-    """Start the localhost link server in a background thread."""
+    """Start the localhost link server in a background thread.
+
+    Each request gets its own thread so one slow click can't hold up others.
+    """
     try:
-        server = HTTPServer(('127.0.0.1', LINK_SERVER_PORT), _ZoteroLinkHandler)
+        server = ThreadingHTTPServer(('127.0.0.1', LINK_SERVER_PORT), _ZoteroLinkHandler)
+        server.daemon_threads = True
         thread = threading.Thread(target=server.serve_forever, daemon=True)
         thread.start()
         logger.info(f"Zotero link server running on http://127.0.0.1:{LINK_SERVER_PORT}")
@@ -126,13 +134,7 @@ async def search_zotero(
         return "No results found."
 
     base = f"http://127.0.0.1:{LINK_SERVER_PORT}"
-    output_parts = [
-        f"Found {len(results)} results.\n\n"
-        "FORMATTING RULES:\n"
-        "1. Write citations as [[N]](url) using the link from each source.\n"
-        "2. At the END of your response, copy the SOURCES block below as-is.\n"
-        "3. Be neutral and professional.\n\n"
-    ]
+    output_parts = [f"Found {len(results)} results.\n\n{_FORMATTING_RULES}"]
     source_lines = []
     for i, r in enumerate(results, 1):
         meta = r['metadata']
@@ -183,8 +185,9 @@ async def search_zotero(
             if arch_loc:
                 archive_info += f", {arch_loc}"
 
-        text_preview = meta.get('text', '')[:800]
-        if len(meta.get('text', '')) > 800:
+        text = meta.get('text', '')
+        text_preview = text[:800]
+        if len(text) > 800:
             text_preview += '...'
 
         rerank_score = r.get('rerank_score')
@@ -202,10 +205,7 @@ async def search_zotero(
 
         source_lines.append(f"- [[{i}]]({link_url}) {citation}{page_str}")
 
-    output_parts.append(
-        "\n---\nSOURCES (copy this block verbatim at the end of your response):\n\n"
-        + '\n'.join(source_lines)
-    )
+    output_parts.append(_SOURCES_HEADER + '\n'.join(source_lines))
 
     return '\n'.join(output_parts)
 
@@ -247,12 +247,7 @@ async def open_zotero_source(
     else:
         return "No zotero_key or attachment_key provided, and no citation_number to look up."
 
-    if sys.platform == "darwin":
-        subprocess.Popen(['open', url])
-    elif sys.platform.startswith("linux"):
-        subprocess.Popen(['xdg-open', url])
-    elif sys.platform == "win32":
-        os.startfile(url)
+    open_url(url)
 
     return f"Opened {label} in Zotero: {url}"
 
@@ -260,7 +255,6 @@ async def open_zotero_source(
 @mcp.tool()
 async def zotero_index_stats() -> str:
     """Get statistics about the indexed Zotero collection."""
-    init_pipeline()
     stats = get_index_stats()
     total = stats.total_vector_count
     return f"Zotero RAG index: {total} chunks indexed"
@@ -268,6 +262,7 @@ async def zotero_index_stats() -> str:
 
 def main():
     logger.info("Zotero RAG MCP Server starting...")
+    init_pipeline()
     _start_link_server()
     mcp.run(transport="stdio")
 
@@ -1,99 +1,208 @@
 """Adaptive chunking for different document types."""
 
 import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+
 import tiktoken
 
 from src.config import CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, SHORT_DOC_THRESHOLD_TOKENS
 
 _enc = tiktoken.get_encoding("cl100k_base")
 
+# A bare printed page number on the first line of a PDF page
+_PAGE_NUMBER_RE = re.compile(r'^(\d{1,5})$')
+
+
+@dataclass(slots=True)
+class Chunk:
+    """A chunk of document text.
+
+    base_meta is the item metadata and is shared, not copied, by every chunk
+    of the same document (or EPUB chapter); per-chunk values live on the chunk.
+    """
+    text: str
+    chunk_index: int
+    total_chunks: int
+    base_meta: dict
+    page_start: int = 0
+    page_end: int = 0
+    pdf_page: int = 0
+
+
+# cl100k averages about four characters per token on English text
+_CHARS_PER_TOKEN = 4
 
-def count_tokens(text):
-    return len(_enc.encode(text))
+
+def _approx_tokens(text):
+    """Estimate the token count from length; close enough for size gating."""
+    return -(-len(text) // _CHARS_PER_TOKEN)
+
+
+# Every byte that is not a UTF-8 continuation byte starts a new character
+_UTF8_LEAD_BYTES = bytes(range(0x80)) + bytes(range(0xC0, 0x100))
+
+
+def _char_len(data):
+    """Count the characters that start within a UTF-8 byte string."""
+    return len(data) - len(data.translate(None, _UTF8_LEAD_BYTES))
 
 
 def _split_by_tokens(text, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
-    """Split text into chunks of roughly chunk_size tokens with overlap."""
-    tokens = _enc.encode(text)
+    """Split text into chunks of roughly chunk_size tokens with overlap.
+
+    Returns list of (chunk_text, start, end) with character offsets into text.
+    """
+    tokens = _enc.encode_ordinary(text)
     chunks = []
     start = 0
+    char_start = 0
     while start < len(tokens):
         end = start + chunk_size
-        chunk_tokens = tokens[start:end]
-        chunk_text = _enc.decode(chunk_tokens)
-        chunks.append(chunk_text)
-        start = end - overlap
+        step = end - overlap
+        head_chars = _char_len(_enc.decode_bytes(tokens[start:step]))
+        char_end = char_start + head_chars + _char_len(_enc.decode_bytes(tokens[step:end]))
+        chunks.append((text[char_start:char_end], char_start, char_end))
+        char_start += head_chars
+        start = step
     return chunks
 
 
-def _split_at_boundaries(text, separators, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
-    """Split text at structural boundaries, then sub-split if chunks are too large."""
-    segments = [text]
-    for sep in separators:
-        new_segments = []
-        for seg in segments:
-            parts = re.split(sep, seg)
-            new_segments.extend(p for p in parts if p.strip())
-        if len(new_segments) > len(segments):
-            segments = new_segments
+@lru_cache(maxsize=None)
+def _combined_separator(separators):
+    """Compile one pattern that finds every separator in a single scan.
+
+    Every separator starts with a newline, so the combined pattern consumes
+    just that newline and tests the rest of each separator as a lookahead;
+    group s{i} records which separator matched there.
+    """
+    alternatives = '|'.join(
+        f'(?=(?P<s{i}>{sep.pattern[2:]}))' for i, sep in enumerate(separators)
+    )
+    return re.compile(rf'\n(?:{alternatives})')
+
+
+def _split_segments(text, separators):
+    """Split text at the first separator that yields more than one segment.
+
+    A single combined scan finds which separators occur at all, so the
+    ones that never match are skipped instead of each rescanning the text.
+
+    Returns list of (segment, offset) pairs; whitespace-only segments are dropped.
+    """
+    found = set()
+    for m in _combined_separator(tuple(separators)).finditer(text):
+        if m.lastgroup == 's0':
+            # The first separator is tried first anyway; check all of them in order
+            found = None
             break
+        found.add(m.lastgroup)
+
+    for i, sep in enumerate(separators):
+        if found is not None and f's{i}' not in found:
+            continue
+        segments = []
+        pos = 0
+        for m in sep.finditer(text):
+            segments.append((text[pos:m.start()], pos))
+            pos = m.end()
+        segments.append((text[pos:], pos))
+        segments = [(seg, offset) for seg, offset in segments if seg.strip()]
+        if len(segments) > 1:
+            return segments
+    return [(text, 0)]
+
+
+def _split_at_boundaries(text, separators, chunk_size=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Split text at structural boundaries, then sub-split if chunks are too large.
+
+    Sizes are gated on character length (see _approx_tokens); only segments
+    too large to fit in one chunk are run through the tokenizer.
 
+    Returns list of (chunk_text, start, end) with character offsets into text.
+    """
+    chunk_size_chars = chunk_size * _CHARS_PER_TOKEN
     chunks = []
     current = ""
-    for seg in segments:
-        combined = (current + "\n\n" + seg).strip() if current else seg
-        if count_tokens(combined) <= chunk_size:
-            current = combined
+    current_start = current_end = 0
+    for seg, offset in _split_segments(text, separators):
+        combined_len = len(current) + 2 + len(seg) if current else len(seg)
+        if combined_len <= chunk_size_chars:
+            if current:
+                current = (current + "\n\n" + seg).strip()
+            else:
+                current = seg
+                current_start = offset
+            current_end = offset + len(seg)
         else:
             if current:
-                chunks.append(current)
-            if count_tokens(seg) > chunk_size:
-                chunks.extend(_split_by_tokens(seg, chunk_size, overlap))
+                chunks.append((current, current_start, current_end))
+            if len(seg) > chunk_size_chars:
+                chunks.extend(
+                    (piece, offset + start, offset + end)
+                    for piece, start, end in _split_by_tokens(seg, chunk_size, overlap)
+                )
             else:
                 current = seg
+                current_start = offset
+                current_end = offset + len(seg)
                 continue
             current = ""
     if current:
-        chunks.append(current)
+        chunks.append((current, current_start, current_end))
 
     return chunks
 
 
 # Congressional hearing structural markers
 HEARING_SEPARATORS = [
-    r'\n(?=STATEMENT OF [A-Z])',
-    r'\n(?=The CHAIRMAN\.)',
-    r'\n(?=Senator [A-Z]+\.)',
-    r'\n(?=Secretary [A-Z]+\.)',
-    r'\n(?=Mr\. [A-Z]+\.)',
-    r'\n(?=CONCLUSION)',
-    r'\n(?=[A-Z][A-Z ]{10,})\n',
+    re.compile(r'\n(?=STATEMENT OF [A-Z])'),
+    re.compile(r'\n(?=The CHAIRMAN\.)'),
+    re.compile(r'\n(?=Senator [A-Z]+\.)'),
+    re.compile(r'\n(?=Secretary [A-Z]+\.)'),
+    re.compile(r'\n(?=Mr\. [A-Z]+\.)'),
+    re.compile(r'\n(?=CONCLUSION)'),
+    re.compile(r'\n(?=[A-Z][A-Z ]{10,})\n'),
 ]
 
 # Meeting minutes markers
 MINUTES_SEPARATORS = [
-    r'\n(?=(?:AGENDA ITEM|Item|ITEM)\s*(?:#|\d))',
-    r'\n(?=(?:OLD BUSINESS|NEW BUSINESS|ROLL CALL|ADJOURNMENT))',
-    r'\n(?=[A-Z][A-Z ]{10,})\n',
+    re.compile(r'\n(?=(?:AGENDA ITEM|Item|ITEM)\s*(?:#|\d))'),
+    re.compile(r'\n(?=(?:OLD BUSINESS|NEW BUSINESS|ROLL CALL|ADJOURNMENT))'),
+    re.compile(r'\n(?=[A-Z][A-Z ]{10,})\n'),
 ]
 
 # Book/report section markers
 SECTION_SEPARATORS = [
-    r'\n(?=(?:CHAPTER|Chapter)\s+\d)',
-    r'\n(?=(?:PART|Part)\s+(?:\d|[IVX]))',
-    r'\n(?=(?:SECTION|Section)\s+\d)',
-    r'\n(?=[A-Z][A-Z ]{10,})\n',
+    re.compile(r'\n(?=(?:CHAPTER|Chapter)\s+\d)'),
+    re.compile(r'\n(?=(?:PART|Part)\s+(?:\d|[IVX]))'),
+    re.compile(r'\n(?=(?:SECTION|Section)\s+\d)'),
+    re.compile(r'\n(?=[A-Z][A-Z ]{10,})\n'),
 ]
 
+# Paragraph breaks, the last-resort boundary for medium documents and notes
+PARAGRAPH_SEPARATOR = re.compile(r'\n\n')
+
+
+# Section markers with paragraph breaks as the last resort
+_SECTION_OR_PARAGRAPH_SEPARATORS = SECTION_SEPARATORS + [PARAGRAPH_SEPARATOR]
+
+_LONG_TYPES = frozenset({'hearing', 'book'})
+_MEDIUM_TYPES = frozenset({'report', 'document'})
+
+# item_type -> (doc_class, separators) for types whose strategy does not depend on length
+_STRATEGY_BY_TYPE = {
+    'hearing': ('long', HEARING_SEPARATORS),
+    'book': ('long', SECTION_SEPARATORS),
+}
+
 
 def classify_document(item_type, text_length_tokens):
     """Classify a document for chunking strategy."""
-    long_types = {'hearing', 'book'}
-    medium_types = {'report', 'document'}
-
-    if item_type in long_types:
+    if item_type in _LONG_TYPES:
         return 'long'
-    if item_type in medium_types and text_length_tokens > SHORT_DOC_THRESHOLD_TOKENS:
+    if item_type in _MEDIUM_TYPES and text_length_tokens > SHORT_DOC_THRESHOLD_TOKENS:
         return 'medium'
     if text_length_tokens <= SHORT_DOC_THRESHOLD_TOKENS:
         return 'short'
@@ -102,6 +211,14 @@ def classify_document(item_type, text_length_tokens):
     return 'short'
 
 
+def _fallback_strategy(item_type, text_length_tokens):
+    """Return (doc_class, separators) for types not in _STRATEGY_BY_TYPE."""
+    doc_class = classify_document(item_type, text_length_tokens)
+    if doc_class == 'medium':
+        return doc_class, _SECTION_OR_PARAGRAPH_SEPARATORS
+    return doc_class, None
+
+
 def chunk_document(text, item_type, metadata):
     """Chunk a document adaptively based on its type and length.
 
@@ -111,39 +228,34 @@ def chunk_document(text, item_type, metadata):
         metadata: dict from extract_item_metadata
 
     Returns:
-        list of chunk dicts
+        list of Chunk
     """
     if not text.strip():
         return []
 
-    token_count = count_tokens(text)
-    doc_class = classify_document(item_type, token_count)
+    token_count = _approx_tokens(text)
+    doc_class, separators = (
+        _STRATEGY_BY_TYPE.get(item_type) or _fallback_strategy(item_type, token_count)
+    )
 
     page_map = _build_page_map(text)
-    page_at_offset = _build_page_at_offset(text)
+    page_breaks = _build_page_breaks(text)
 
     stripped = text.replace('\f', '')
 
     if doc_class == 'short':
         result = [_make_chunk(stripped, 0, 1, metadata)]
-        _assign_pages_by_position(result, stripped, page_at_offset, page_map)
+        _assign_pages(result, [(0, len(stripped))], stripped, page_breaks, page_map)
         return result
 
-    if doc_class == 'long':
-        if item_type == 'hearing':
-            separators = HEARING_SEPARATORS
-        else:
-            separators = SECTION_SEPARATORS
-        chunks = _split_at_boundaries(stripped, separators)
-    elif doc_class == 'medium':
-        separators = SECTION_SEPARATORS + [r'\n\n']
-        chunks = _split_at_boundaries(stripped, separators)
+    if separators:
+        pieces = _split_at_boundaries(stripped, separators)
     else:
-        chunks = _split_by_tokens(stripped)
+        pieces = _split_by_tokens(stripped)
 
-    total = len(chunks)
-    result = [_make_chunk(chunk_text, i, total, metadata) for i, chunk_text in enumerate(chunks)]
-    _assign_pages_by_position(result, stripped, page_at_offset, page_map)
+    total = len(pieces)
+    result = [_make_chunk(chunk_text, i, total, metadata) for i, (chunk_text, _, _) in enumerate(pieces)]
+    _assign_pages(result, [(start, end) for _, start, end in pieces], stripped, page_breaks, page_map)
     return result
 
 
@@ -156,24 +268,21 @@ def chunk_epub(chapters, metadata):
         if not chapter_text.strip():
             continue
 
-        token_count = count_tokens(chapter_text)
+        token_count = _approx_tokens(chapter_text)
         chapter_meta = {**metadata, 'chapter': chapter_title}
 
         if token_count <= CHUNK_SIZE_TOKENS:
             all_chunks.append(_make_chunk(chapter_text, chunk_index, -1, chapter_meta))
             chunk_index += 1
         else:
-            sub_chunks = _split_at_boundaries(
-                chapter_text,
-                SECTION_SEPARATORS + [r'\n\n'],
-            )
-            for sc in sub_chunks:
+            sub_chunks = _split_at_boundaries(chapter_text, _SECTION_OR_PARAGRAPH_SEPARATORS)
+            for sc, _, _ in sub_chunks:
                 all_chunks.append(_make_chunk(sc, chunk_index, -1, chapter_meta))
                 chunk_index += 1
 
     total = len(all_chunks)
     for c in all_chunks:
-        c['total_chunks'] = total
+        c.total_chunks = total
 
     return all_chunks
 
@@ -184,14 +293,14 @@ def chunk_note(text, metadata, source_type='child_note'):
         return []
 
     note_meta = {**metadata, 'source_type': source_type}
-    token_count = count_tokens(text)
+    token_count = _approx_tokens(text)
 
     if token_count <= CHUNK_SIZE_TOKENS:
         return [_make_chunk(text, 0, 1, note_meta)]
 
-    chunks = _split_at_boundaries(text, [r'\n\n'])
+    chunks = _split_at_boundaries(text, [PARAGRAPH_SEPARATOR])
     total = len(chunks)
-    return [_make_chunk(ct, i, total, note_meta) for i, ct in enumerate(chunks)]
+    return [_make_chunk(ct, i, total, note_meta) for i, (ct, _, _) in enumerate(chunks)]
 
 
 def _build_page_map(text):
@@ -205,7 +314,7 @@ def _build_page_map(text):
         if not lines:
             continue
         first_line = lines[0].strip()
-        m = re.match(r'^(\d{1,5})$', first_line)
+        m = _PAGE_NUMBER_RE.match(first_line)
         if m:
             detected[pdf_page] = int(m.group(1))
 
@@ -213,66 +322,62 @@ def _build_page_map(text):
     if not detected or len(detected) / max(total_pages, 1) < 0.3:
         return None
 
+    # detected is filled in page order, so its keys are already sorted
+    det_pdfs = list(detected)
     page_map = {}
-    sorted_detected = sorted(detected.items())
 
     for pdf_page in range(1, total_pages + 1):
         if pdf_page in detected:
             page_map[pdf_page] = detected[pdf_page]
-        else:
-            best_dist = float('inf')
-            best_offset = 0
-            for det_pdf, det_printed in sorted_detected:
-                dist = abs(pdf_page - det_pdf)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_offset = det_pdf - det_printed
-            page_map[pdf_page] = max(1, pdf_page - best_offset)
+            continue
+        # Nearest detected page by bisection; ties go to the earlier page
+        idx = bisect_left(det_pdfs, pdf_page)
+        if idx == len(det_pdfs) or (idx > 0 and pdf_page - det_pdfs[idx - 1] <= det_pdfs[idx] - pdf_page):
+            idx -= 1
+        det_pdf = det_pdfs[idx]
+        page_map[pdf_page] = max(1, pdf_page - (det_pdf - detected[det_pdf]))
 
     return page_map
 
 
-def _build_page_at_offset(text):
-    """Build an array mapping each character offset in \\f-stripped text to its PDF page."""
-    result = []
-    pdf_page = 1
-    for ch in text:
-        if ch == '\f':
-            pdf_page += 1
-        else:
-            result.append(pdf_page)
-    return result
+def _build_page_breaks(text):
+    """Return the offsets in \\f-stripped text at which each page after the first begins.
 
+    A character at stripped offset o is on PDF page _page_at(page_breaks, o).
+    """
+    breaks = []
+    pos = text.find('\f')
+    while pos >= 0:
+        breaks.append(pos - len(breaks))
+        pos = text.find('\f', pos + 1)
+    return breaks
 
-def _assign_pages_by_position(chunks, stripped_text, page_at_offset, page_map):
-    """Assign page numbers to chunks by finding their position in the original text."""
-    search_start = 0
-    for chunk in chunks:
-        text = chunk['text']
-        needle = text[:min(100, len(text))]
-        pos = stripped_text.find(needle, max(0, search_start - 500))
-        if pos >= 0 and pos < len(page_at_offset):
-            pdf_start = page_at_offset[pos]
-            end_pos = min(pos + len(text) - 1, len(page_at_offset) - 1)
-            pdf_end = page_at_offset[end_pos] if end_pos >= 0 else pdf_start
-            search_start = pos + 1
-        else:
-            pdf_start = search_start
-            pdf_end = pdf_start
+
+def _page_at(page_breaks, offset):
+    """Return the 1-based PDF page containing a stripped-text offset."""
+    return bisect_right(page_breaks, offset) + 1
+
+
+def _assign_pages(chunks, spans, stripped_text, page_breaks, page_map):
+    """Assign page numbers to chunks from their (start, end) offsets in the stripped text."""
+    for chunk, (start, end) in zip(chunks, spans):
+        # Skip the surrounding whitespace that _make_chunk strips from the text
+        while start < end and stripped_text[start].isspace():
+            start += 1
+        while end > start and stripped_text[end - 1].isspace():
+            end -= 1
+
+        pdf_start = _page_at(page_breaks, start)
+        pdf_end = _page_at(page_breaks, end - 1) if end > start else pdf_start
 
         if page_map:
-            chunk['metadata']['page_start'] = page_map.get(pdf_start, pdf_start)
-            chunk['metadata']['page_end'] = page_map.get(pdf_end, pdf_end)
+            chunk.page_start = page_map.get(pdf_start, pdf_start)
+            chunk.page_end = page_map.get(pdf_end, pdf_end)
         else:
-            chunk['metadata']['page_start'] = pdf_start
-            chunk['metadata']['page_end'] = pdf_end
-        chunk['metadata']['pdf_page'] = pdf_start
+            chunk.page_start = pdf_start
+            chunk.page_end = pdf_end
+        chunk.pdf_page = pdf_start
 
 
 def _make_chunk(text, chunk_index, total_chunks, metadata):
-    return {
-        'text': text.strip(),
-        'chunk_index': chunk_index,
-        'total_chunks': total_chunks,
-        'metadata': dict(metadata),
-    }
+    return Chunk(text.strip(), chunk_index, total_chunks, metadata)
@@ -37,6 +37,10 @@ EMBEDDING_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", "1536"))
 OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
 
+# Persistent embedding cache (skips the API for text that was embedded before)
+CACHE_EMBEDDINGS = os.environ.get("CACHE_EMBEDDINGS", "0") == "1"
+EMBEDDING_CACHE_FILE = CACHE_DIR / "embeddings.sqlite"
+
 # Pinecone vector database
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY", "")
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "zotero-rag")
@@ -54,6 +58,9 @@ OPENAI_CHAT_MODEL = os.environ.get("OPENAI_CHAT_MODEL", "gpt-4o-mini")
 # Ollama chat (free, runs locally)
 OLLAMA_CHAT_MODEL = os.environ.get("OLLAMA_CHAT_MODEL", "llama3.1")
 
+# Common queries to embed when the search pipeline starts (JSON list of strings)
+QUERY_WARMUP_FILE = PROJECT_ROOT / "warmup_queries.json"
+
 # Sync state file
 SYNC_STATE_FILE = PROJECT_ROOT / "sync_state.json"
 
@@ -0,0 +1,81 @@
+"""Persistent embedding cache backed by SQLite.
+
+Vectors are keyed by the SHA-256 of the embedded text plus the provider and
+model that produced them, so re-indexing unchanged text never hits the API.
+Enabled with CACHE_EMBEDDINGS=1.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+
+import numpy as np
+
+from src.config import EMBEDDING_CACHE_FILE
+
+logger = logging.getLogger(__name__)
+
+_conn = None
+_lock = threading.Lock()
+
+# Stay well under SQLite's bound-parameter limit for IN (...) lookups
+_LOOKUP_BATCH = 500
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(EMBEDDING_CACHE_FILE, check_same_thread=False)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb_cache ("
+            "hash TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, "
+            "vec BLOB NOT NULL, PRIMARY KEY (hash, provider, model))"
+        )
+        logger.info(f"Embedding cache: {EMBEDDING_CACHE_FILE}")
+    return _conn
+
+
+def text_hash(text):
+    """Return the cache key for a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_many(hashes, provider, model):
+    """Look up cached vectors.
+
+    Returns dict mapping hash -> float32 vector for the hashes that were found.
+    """
+    found = {}
+    unique = list(dict.fromkeys(hashes))
+    with _lock:
+        conn = _get_conn()
+        for i in range(0, len(unique), _LOOKUP_BATCH):
+            batch = unique[i:i + _LOOKUP_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(
+                f"SELECT hash, vec FROM emb_cache WHERE hash IN ({placeholders}) "
+                "AND provider = ? AND model = ?",
+                (*batch, provider, model),
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    return found
+
+
+def put_many(items, provider, model):
+    """Store (hash, vector) pairs. Vectors are stored as float16 to halve disk use."""
+    rows = [
+        (h, provider, model, np.asarray(vec, dtype=np.float16).tobytes())
+        for h, vec in items
+    ]
+    if not rows:
+        return
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO emb_cache (hash, provider, model, vec) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
@@ -1,29 +1,121 @@
 """Embedding client supporting OpenAI and Ollama backends."""
 
+import base64
+import hashlib
 import logging
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
+from src import embedding_cache
 from src.config import (
     EMBEDDING_PROVIDER, OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSION,
-    OLLAMA_BASE_URL, OLLAMA_EMBED_MODEL,
+    OLLAMA_BASE_URL, OLLAMA_EMBED_MODEL, CACHE_EMBEDDINGS,
 )
 
 logger = logging.getLogger(__name__)
 
 _client = None
 _provider = None
+_http = None
+
+OLLAMA_BATCH_SIZE = 64
+OLLAMA_MAX_WORKERS = 4
+
+# Keeps each request well under OpenAI's per-request token limit
+OPENAI_BATCH_SIZE = 256
+OPENAI_MAX_WORKERS = 8
+OPENAI_MAX_REQUESTS_PER_SECOND = 20
+OPENAI_MAX_RETRIES = 4
+
+
+class _RateLimiter:
+    """Spaces out calls so they stay under a requests-per-second budget."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+_openai_limiter = _RateLimiter(OPENAI_MAX_REQUESTS_PER_SECOND)
+
+
+class _QueryEmbedCache:
+    """LRU cache of query embeddings whose entries expire after ttl seconds.
+
+    Vectors are held as float16 to halve memory and widened to float32 on get.
+    """
+
+    def __init__(self, capacity=1024, ttl=3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query_text):
+        normalized = query_text.strip().lower().encode('utf-8')
+        return hashlib.blake2b(normalized, digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, vec = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return vec.astype(np.float32)
+
+    def put(self, key, vec):
+        vec = np.asarray(vec, dtype=np.float16)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+
+_query_cache = _QueryEmbedCache()
 
 
 def init_embeddings():
-    """Initialize the embedding client based on EMBEDDING_PROVIDER config."""
-    global _client, _provider
-    _provider = EMBEDDING_PROVIDER.lower()
+    """Initialize the embedding client based on EMBEDDING_PROVIDER config.
 
-    if _provider == "ollama":
+    Only the first call does any work; later calls reuse the client and skip
+    the Ollama reachability check.
+    """
+    global _client, _provider, _http
+    if _provider is not None:
+        return
+    import httpx
+    provider = EMBEDDING_PROVIDER.lower()
+    # One pooled client for every embedding request, so re-indexing reuses
+    # connections instead of paying a TCP/TLS handshake per batch
+    _http = httpx.Client(
+        http2=True,
+        timeout=120,
+        limits=httpx.Limits(max_keepalive_connections=16),
+    )
+
+    if provider == "ollama":
         # Verify Ollama is reachable
-        import urllib.request
         try:
-            urllib.request.urlopen(OLLAMA_BASE_URL, timeout=5)
+            _http.get(f"{OLLAMA_BASE_URL}/", timeout=5)
         except Exception:
             raise ConnectionError(
                 f"Cannot reach Ollama at {OLLAMA_BASE_URL}. "
@@ -34,89 +126,184 @@ def init_embeddings():
         from openai import OpenAI
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY not set. Export it or add to .env file.")
-        _client = OpenAI(api_key=OPENAI_API_KEY)
+        _client = OpenAI(api_key=OPENAI_API_KEY, http_client=_http)
         logger.info(f"Using OpenAI embeddings: {EMBEDDING_MODEL}")
+    # Set last so a failed init is retried on the next call
+    _provider = provider
+
+
+def _sanitize(text):
+    """Replace empty input and truncate overlong input before embedding."""
+    text = text.strip() if text else ""
+    if not text:
+        text = "[empty]"
+    if len(text) > 30000:
+        text = text[:30000]
+    return text
 
 
 def _embed_ollama(texts):
-    """Embed texts using Ollama's local API."""
-    import json
-    import urllib.request
-
-    embeddings = []
-    for text in texts:
-        text = text.strip() or "[empty]"
-        if len(text) > 30000:
-            text = text[:30000]
-        req = urllib.request.Request(
-            f"{OLLAMA_BASE_URL}/api/embeddings",
-            data=json.dumps({"model": OLLAMA_EMBED_MODEL, "prompt": text}).encode(),
-            headers={"Content-Type": "application/json"},
+    """Embed texts using Ollama's batch /api/embed endpoint.
+
+    Batches are sent concurrently over a pooled connection so request
+    overhead overlaps with model work.
+    """
+    batches = [
+        texts[i:i + OLLAMA_BATCH_SIZE]
+        for i in range(0, len(texts), OLLAMA_BATCH_SIZE)
+    ]
+
+    def _one_batch(batch):
+        resp = _http.post(
+            f"{OLLAMA_BASE_URL}/api/embed",
+            json={"model": OLLAMA_EMBED_MODEL, "input": batch},
         )
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            result = json.loads(resp.read())
-        embeddings.append(result["embedding"])
-    return embeddings
+        resp.raise_for_status()
+        return resp.json()["embeddings"]
 
+    if len(batches) == 1:
+        return np.asarray(_one_batch(batches[0]), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=OLLAMA_MAX_WORKERS) as executor:
+        results = list(executor.map(_one_batch, batches))
+    return np.asarray([emb for batch_result in results for emb in batch_result], dtype=np.float32)
 
-def _embed_openai(texts):
-    """Embed texts using OpenAI API."""
-    sanitized = []
-    for t in texts:
-        t = t.strip() if t else ""
-        if not t:
-            t = "[empty]"
-        if len(t) > 30000:
-            t = t[:30000]
-        sanitized.append(t)
-
-    BATCH_SIZE = 2048
-    all_embeddings = []
-
-    for i in range(0, len(sanitized), BATCH_SIZE):
-        batch = sanitized[i:i + BATCH_SIZE]
+
+def _decode_embeddings(response):
+    """Decode a base64-encoded OpenAI embeddings response into float32 vectors."""
+    return [np.frombuffer(base64.b64decode(d.embedding), dtype=np.float32) for d in response.data]
+
+
+def _embed_openai_batch(batch):
+    """Embed one batch, retrying on rate limits and transient server errors."""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        _openai_limiter.wait()
         try:
             response = _client.embeddings.create(
                 model=EMBEDDING_MODEL,
                 input=batch,
+                encoding_format="base64",
             )
-            all_embeddings.extend([d.embedding for d in response.data])
+            return _decode_embeddings(response)
         except Exception as e:
-            if 'rate' in str(e).lower() or '429' in str(e):
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            status = getattr(e, 'status_code', None)
+            if status == 429 or 'rate' in str(e).lower():
                 logger.warning("Rate limited, waiting 60s...")
                 time.sleep(60)
-                response = _client.embeddings.create(
-                    model=EMBEDDING_MODEL,
-                    input=batch,
-                )
-                all_embeddings.extend([d.embedding for d in response.data])
+            elif status is not None and status >= 500:
+                delay = 2 ** attempt
+                logger.warning(f"OpenAI server error {status}, retrying in {delay}s...")
+                time.sleep(delay)
             else:
                 raise
 
-    return all_embeddings
+
+def _embed_openai(texts):
+    """Embed texts using OpenAI API.
+
+    Batches are sent concurrently; results keep the input order.
+    """
+    batches = [
+        texts[i:i + OPENAI_BATCH_SIZE]
+        for i in range(0, len(texts), OPENAI_BATCH_SIZE)
+    ]
+
+    if len(batches) == 1:
+        return np.vstack(_embed_openai_batch(batches[0]))
+    with ThreadPoolExecutor(max_workers=OPENAI_MAX_WORKERS) as executor:
+        results = list(executor.map(_embed_openai_batch, batches))
+    return np.vstack([vec for batch_result in results for vec in batch_result])
+
+
+def _embed_uncached(texts):
+    """Embed texts with the configured provider, sending each distinct text once."""
+    sanitized = [_sanitize(t) for t in texts]
+    unique = list(dict.fromkeys(sanitized))
+    if _provider == "ollama":
+        vectors = _embed_ollama(unique)
+    else:
+        vectors = _embed_openai(unique)
+    if len(unique) == len(sanitized):
+        return vectors
+    position = {t: i for i, t in enumerate(unique)}
+    return vectors[[position[t] for t in sanitized]]
+
+
+def _embed_cached(texts):
+    """Embed texts, reusing vectors from the persistent cache where possible."""
+    provider = "ollama" if _provider == "ollama" else "openai"
+    model = OLLAMA_EMBED_MODEL if provider == "ollama" else EMBEDDING_MODEL
+
+    hashes = [embedding_cache.text_hash(t) for t in texts]
+    cached = embedding_cache.get_many(hashes, provider, model)
+
+    uncached_indices = [i for i, h in enumerate(hashes) if h not in cached]
+    fresh = {}
+    if uncached_indices:
+        uncached_texts = [texts[i] for i in uncached_indices]
+        vectors = _embed_uncached(uncached_texts)
+        fresh = {hashes[i]: v for i, v in zip(uncached_indices, vectors)}
+        embedding_cache.put_many(fresh.items(), provider, model)
+
+    logger.debug(f"Embedding cache: {len(texts) - len(uncached_indices)} hits, "
+                 f"{len(uncached_indices)} misses")
+    return np.vstack([fresh[h] if h in fresh else cached[h] for h in hashes])
 
 
 def embed_texts(texts):
     """Embed a batch of texts for indexing.
 
-    Returns list of embedding vectors.
+    Returns a float32 array of shape (len(texts), dimension).
     """
     if not texts:
-        return []
-    if _provider == "ollama":
-        return _embed_ollama(texts)
-    return _embed_openai(texts)
+        return np.empty((0, 0), dtype=np.float32)
+    if CACHE_EMBEDDINGS:
+        return _embed_cached(texts)
+    return _embed_uncached(texts)
 
 
-def embed_query(query_text):
-    """Embed a single search query."""
+def _embed_query_uncached(query_text):
     if _provider == "ollama":
-        return _embed_ollama([query_text])[0]
+        return _embed_ollama([_sanitize(query_text)])[0]
     response = _client.embeddings.create(
         model=EMBEDDING_MODEL,
         input=query_text,
+        encoding_format="base64",
     )
-    return response.data[0].embedding
+    return _decode_embeddings(response)[0]
+
+
+def embed_query(query_text):
+    """Embed a single search query, reusing recent embeddings of the same query.
+
+    Misses fall through to the persistent cache when CACHE_EMBEDDINGS is set.
+    Returns a float32 vector.
+    """
+    key = _query_cache.key(query_text)
+    vec = _query_cache.get(key)
+    if vec is None:
+        if CACHE_EMBEDDINGS:
+            vec = _embed_cached([query_text])[0]
+        else:
+            vec = np.asarray(_embed_query_uncached(query_text), dtype=np.float32)
+        _query_cache.put(key, vec)
+    return vec
+
+
+def warmup_query_cache(queries):
+    """Pre-embed queries that are not cached yet in a single batch call."""
+    pending = {}
+    for q in queries:
+        key = _query_cache.key(q)
+        if _query_cache.get(key) is None:
+            pending.setdefault(key, q)
+    if not pending:
+        return
+    vectors = embed_texts(list(pending.values()))
+    for key, vec in zip(pending, vectors):
+        _query_cache.put(key, vec)
+    logger.info(f"Warmed query cache with {len(pending)} queries")
 
 
 def get_embedding_dimension():
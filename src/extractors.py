@@ -1,65 +1,118 @@
 """Text extraction from Zotero attachments: PDF, EPUB, HTML snapshots, and notes."""
 
+import codecs
 import logging
+import mmap
+import os
 import re
-import subprocess
 import tempfile
 from pathlib import Path
 
 from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
 
 from src.config import CACHE_DIR
 
 logger = logging.getLogger(__name__)
 
+# Patterns lead with a literal where possible so re can skip ahead with a fast search
+_HYPHEN_BREAK_RE = re.compile(r'-\n(?<=\w-\n)(?=\w)')
+_MULTI_NEWLINE_RE = re.compile(r'\n\n\n+')
+# Inline whitespace other than a plain space (tabs, \r, NBSP, ...), then runs of spaces
+_ODD_SPACE_RE = re.compile(r'[^\S\n\f ]')
+_SPACE_RUN_RE = re.compile(r'  +')
+# Filenames of PDFs that hold only part of a document
+_PARTIAL_PDF_RE = re.compile(r'_from_\d+_to_\d+|_part_\d+')
+
+# Carriage returns left after \r\n normalization and PDFium's soft-hyphen marker
+_PDFIUM_STRAY_CHARS = {ord('\r'): None, 0xFFFE: None}
+
+# Elements whose text is never wanted, and page furniture dropped from snapshots
+_NON_TEXT_TAGS = ('script', 'style')
+_BOILERPLATE_TAGS = _NON_TEXT_TAGS + ('nav', 'header', 'footer')
+
 
 def preprocess_text(text):
     """Clean up extracted text: rejoin hyphenated line breaks, normalize whitespace."""
-    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r'[^\S\n\f]+', ' ', text)
+    text = _HYPHEN_BREAK_RE.sub('', text)
+    text = _MULTI_NEWLINE_RE.sub('\n\n', text)
+    text = _ODD_SPACE_RE.sub(' ', text)
+    text = _SPACE_RUN_RE.sub(' ', text)
     return text.strip()
 
 
+def _count_form_feeds(buf):
+    """Count page-break bytes in a bytes-like buffer (mmap has no .count)."""
+    count = 0
+    pos = buf.find(b'\f')
+    while pos != -1:
+        count += 1
+        pos = buf.find(b'\f', pos + 1)
+    return count
+
+
+def _read_cached_text(cache_path):
+    """Decode a cached PDF text file straight from a memory map.
+
+    Avoids holding a bytes copy of the whole file alongside the decoded text.
+    Returns (text, page_count) tuple.
+    """
+    with open(cache_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "", 1
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            page_count = _count_form_feeds(mm)
+            # Every page ends in a form feed; count a trailing unterminated page too
+            if mm[-1:] != b'\f':
+                page_count += 1
+            text, _ = codecs.utf_8_decode(mm, 'replace', True)
+    return text, page_count
+
+
+def _pdfium_page_text(page):
+    """Extract one page's text, normalized to match pdftotext's line breaks."""
+    textpage = page.get_textpage()
+    try:
+        text = textpage.get_text_range()
+    finally:
+        textpage.close()
+    # PDFium ends lines with \r\n and marks rejoined hyphenations with U+FFFE
+    return text.replace('\r\n', '\n').translate(_PDFIUM_STRAY_CHARS)
+
+
 def extract_pdf_text(pdf_bytes, item_key):
-    """Extract text from PDF bytes using pdftotext -layout.
+    """Extract text from PDF bytes in-process with PDFium.
 
     Returns (text, page_count) tuple.
     """
     cache_path = CACHE_DIR / f"{item_key}.txt"
     if cache_path.exists():
-        text = cache_path.read_text(encoding='utf-8')
-        page_count = text.count('\f') + 1
+        text, page_count = _read_cached_text(cache_path)
         return preprocess_text(text), page_count
 
-    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
-        f.write(pdf_bytes)
-        tmp_path = f.name
+    import pypdfium2 as pdfium
 
     try:
-        result = subprocess.run(
-            ['pdftotext', '-layout', tmp_path, '-'],
-            capture_output=True, timeout=120
-        )
-        text = result.stdout.decode('utf-8', errors='replace')
-        page_count = text.count('\f') + 1
-
-        cache_path.write_text(text, encoding='utf-8')
-
-        return preprocess_text(text), page_count
-    except FileNotFoundError:
-        logger.error(
-            "pdftotext not found. Install it:\n"
-            "  macOS:  brew install poppler\n"
-            "  Ubuntu: sudo apt install poppler-utils\n"
-            "  Windows: download from https://github.com/oschwartz10612/poppler-windows/releases"
-        )
-        return "", 0
-    except subprocess.TimeoutExpired:
-        logger.warning(f"pdftotext timed out for {item_key}")
+        pdf = pdfium.PdfDocument(pdf_bytes)
+    except pdfium.PdfiumError as e:
+        logger.warning(f"Could not open PDF for {item_key}: {e}")
         return "", 0
+    try:
+        page_count = len(pdf)
+        pages = []
+        for page in pdf:
+            try:
+                pages.append(_pdfium_page_text(page))
+            finally:
+                page.close()
     finally:
-        Path(tmp_path).unlink(missing_ok=True)
+        pdf.close()
+
+    # Same layout as pdftotext output: every page is terminated by a form feed
+    text = ''.join(f"{page_text}\f" for page_text in pages)
+    cache_path.write_text(text, encoding='utf-8')
+    return preprocess_text(text), page_count
 
 
 def extract_epub_text(epub_bytes, item_key):
@@ -79,10 +132,8 @@ def extract_epub_text(epub_bytes, item_key):
         chapters = []
 
         for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-            soup = BeautifulSoup(item.get_content(), 'lxml')
-            heading = soup.find(['h1', 'h2', 'h3'])
-            title = heading.get_text(strip=True) if heading else item.get_name()
-            text = soup.get_text(separator='\n')
+            heading, text = _epub_chapter(item.get_content())
+            title = heading if heading is not None else item.get_name()
             text = preprocess_text(text)
             if text.strip():
                 chapters.append((title, text))
@@ -92,24 +143,60 @@ def extract_epub_text(epub_bytes, item_key):
         Path(tmp_path).unlink(missing_ok=True)
 
 
+def _epub_chapter(content):
+    """Return (heading, text) for an EPUB XHTML document.
+
+    heading is the text of the first h1-h3, or None if there is none.
+    """
+    try:
+        tree = lxml_html.fromstring(content)
+    except (etree.ParserError, ValueError):
+        soup = BeautifulSoup(content, 'lxml')
+        heading = soup.find(['h1', 'h2', 'h3'])
+        return (heading.get_text(strip=True) if heading else None), soup.get_text(separator='\n')
+
+    headings = tree.xpath('(//h1|//h2|//h3)[1]')
+    heading = ''.join(s.strip() for s in headings[0].itertext()) if headings else None
+    return heading, _tree_text(tree, _NON_TEXT_TAGS)
+
+
+def _tree_text(tree, drop_tags):
+    """Return the text of an lxml tree with one text node per line, minus drop_tags elements."""
+    for el in list(tree.iter(*drop_tags)):
+        if el is tree:
+            return ""
+        # drop_tree keeps the text that follows the element
+        el.drop_tree()
+    return '\n'.join(tree.itertext())
+
+
+def _html_to_text(html_content, drop_boilerplate=False):
+    """Return the text of an HTML document with one text node per line.
+
+    Uses lxml directly; BeautifulSoup is only a fallback for input lxml refuses.
+    """
+    drop_tags = _BOILERPLATE_TAGS if drop_boilerplate else _NON_TEXT_TAGS
+    try:
+        tree = lxml_html.fromstring(html_content)
+    except (etree.ParserError, ValueError):
+        soup = BeautifulSoup(html_content, 'lxml')
+        for tag in soup(list(drop_tags)):
+            tag.decompose()
+        return soup.get_text(separator='\n')
+    return _tree_text(tree, drop_tags)
+
+
 def extract_html_text(html_content):
     """Extract text from HTML snapshot content."""
     if isinstance(html_content, bytes):
         html_content = html_content.decode('utf-8', errors='replace')
 
-    soup = BeautifulSoup(html_content, 'lxml')
-    for tag in soup(['script', 'style', 'nav', 'header', 'footer']):
-        tag.decompose()
-
-    text = soup.get_text(separator='\n')
-    return preprocess_text(text)
+    return preprocess_text(_html_to_text(html_content, drop_boilerplate=True))
 
 
 def extract_note_text(note_html):
     """Extract plain text from a Zotero note (HTML)."""
-    soup = BeautifulSoup(note_html, 'lxml')
-    text = soup.get_text(separator='\n')
-    return preprocess_text(text)
+    return preprocess_text(_html_to_text(note_html))
 
 
 def select_best_attachment(attachments):
@@ -146,7 +233,7 @@ def select_best_attachment(attachments):
         for pdf in pdfs:
             pages = pdf['data'].get('numPages', 0) or 0
             filename = pdf['data'].get('filename', '')
-            if re.search(r'_from_\d+_to_\d+|_part_\d+', filename):
+            if _PARTIAL_PDF_RE.search(filename):
                 continue
             if pages > best_pages:
                 best = pdf
@@ -1,25 +1,43 @@
 """Main indexing pipeline: Zotero items -> text extraction -> chunking -> embedding -> Pinecone."""
 
-import json
+import hashlib
 import logging
+import multiprocessing
+import os
 import re
 import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
 
 from src.config import SYNC_STATE_FILE, ARCHIVE_ALIASES_FILE, COLLECTION_KEY
 from src.zotero_client import (
-    get_zotero_client, build_collection_tree, get_all_items,
+    get_zotero_client, get_thread_zotero_client, build_collection_tree, get_all_items,
     get_child_attachments,
 )
 from src.extractors import (
     select_best_attachment, extract_pdf_text, extract_epub_text,
     extract_html_text, extract_item_metadata,
 )
-from src.chunker import chunk_document, chunk_epub
+from src.chunker import Chunk, chunk_document, chunk_epub
 from src.embeddings import init_embeddings, embed_texts, get_embedding_dimension
-from src.vectordb import init_pinecone, upsert_chunks, delete_by_zotero_key
+from src.vectordb import (
+    init_pinecone, upsert_chunks, fetch_vectors, delete_by_zotero_key, delete_chunks_from,
+    clean_metadata,
+)
 
 logger = logging.getLogger(__name__)
 
+EXTRACT_WORKERS = os.cpu_count() or 1
+DOWNLOAD_WORKERS = 4
+# Seconds one item may spend in extraction and chunking before it is skipped
+EXTRACT_TIMEOUT = 120
+# Recent embeddings kept by content hash so duplicate chunks in later batches
+# (e.g. the same document attached to two items) are not embedded again
+EMBED_MEMO_SIZE = 2048
+
 
 def _build_context_header(metadata):
     """Build a metadata header to prepend to chunk text before embedding."""
@@ -41,6 +59,36 @@ def _build_context_header(metadata):
     return '\n'.join(parts) + '\n---\n'
 
 
+def _content_hash(text):
+    """Hash of the exact text sent for embedding, stored with each vector."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+_OPTIONAL_META_KEYS = ('attachment_key', 'attachment_type', 'chapter')
+
+
+def _item_fields(meta):
+    """Flatten the item-level metadata shared by every chunk of an item for Pinecone."""
+    fields = {
+        'zotero_key': meta['zotero_key'],
+        'title': meta['title'],
+        'authors': meta['authors'],
+        'item_type': meta['item_type'],
+        'date': meta['date'],
+        'archive': meta.get('archive', ''),
+        'archive_location': meta.get('archive_location', ''),
+        'tags': meta['tags'],
+        'collections': meta['collections'],
+        'archive_collection': meta.get('archive_collection', ''),
+        'source_type': meta.get('source_type', 'document'),
+        'page_count': meta.get('page_count', 0),
+    }
+    for key in _OPTIONAL_META_KEYS:
+        if key in meta:
+            fields[key] = meta[key]
+    return fields
+
+
 def build_archive_aliases(collection_tree):
     """Build an alias map from the collection tree.
 
@@ -57,23 +105,50 @@ def build_archive_aliases(collection_tree):
                 aliases[acronym] = ct['archive_name']
 
     result = {'aliases': aliases}
-    ARCHIVE_ALIASES_FILE.write_text(json.dumps(result, indent=2))
+    ARCHIVE_ALIASES_FILE.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
     logger.info(f"Archive aliases saved: {len(aliases)} acronyms")
     return result
 
 
 def load_sync_state():
-    if SYNC_STATE_FILE.exists():
-        return json.loads(SYNC_STATE_FILE.read_text())
-    return {'library_version': 0, 'indexed_keys': []}
+    """Load sync state: the library version and a map of indexed item key -> item version."""
+    if not SYNC_STATE_FILE.exists():
+        return {'library_version': 0, 'indexed': {}}
+    state = orjson.loads(SYNC_STATE_FILE.read_bytes())
+    if 'indexed' not in state:
+        # Older state files list keys only; those items were current as of library_version
+        version = state.get('library_version', 0)
+        state['indexed'] = dict.fromkeys(state.pop('indexed_keys', []), version)
+    return state
 
 
 def save_sync_state(state):
-    SYNC_STATE_FILE.write_text(json.dumps(state, indent=2))
+    SYNC_STATE_FILE.write_bytes(orjson.dumps(state, option=orjson.OPT_INDENT_2))
 
 
-def process_item(zot, item, collection_tree):
-    """Process a single Zotero item: extract text, chunk, return chunks."""
+def fetch_item_attachment(zot, item):
+    """Download the best attachment for an item.
+
+    Returns (attachment_key, attachment_type, file_bytes). attachment_key is
+    None when the item has no usable attachment; file_bytes is None when the
+    download failed.
+    """
+    attachments = get_child_attachments(zot, item['key'])
+    best_att, att_type = select_best_attachment(attachments)
+    if not best_att:
+        return None, None, None
+    try:
+        return best_att['key'], att_type, zot.file(best_att['key'])
+    except Exception as e:
+        logger.warning(f"Failed to download {att_type} for {item['key']}: {e}")
+        return best_att['key'], att_type, None
+
+
+def chunk_item(item, att_key, att_type, file_bytes):
+    """Extract text from a downloaded attachment (or the item's own fields) and chunk it.
+
+    Needs no Zotero client, so it can run in a worker process.
+    """
     metadata = extract_item_metadata(item)
     item_key = item['key']
     item_type = item['data']['itemType']
@@ -82,36 +157,33 @@ def process_item(zot, item, collection_tree):
 
     chunks = []
 
-    attachments = get_child_attachments(zot, item_key)
-    best_att, att_type = select_best_attachment(attachments)
+    if att_key and file_bytes is None:
+        return chunks
 
-    if best_att and att_type == 'pdf':
+    if att_type == 'pdf':
         try:
-            pdf_bytes = zot.file(best_att['key'])
-            text, page_count = extract_pdf_text(pdf_bytes, best_att['key'])
+            text, page_count = extract_pdf_text(file_bytes, att_key)
             if text.strip():
-                metadata['attachment_key'] = best_att['key']
+                metadata['attachment_key'] = att_key
                 metadata['attachment_type'] = 'pdf'
                 metadata['page_count'] = page_count
                 chunks = chunk_document(text, item_type, metadata)
         except Exception as e:
             logger.warning(f"Failed to extract PDF for {item_key}: {e}")
 
-    elif best_att and att_type == 'epub':
+    elif att_type == 'epub':
         try:
-            epub_bytes = zot.file(best_att['key'])
-            chapters = extract_epub_text(epub_bytes, best_att['key'])
+            chapters = extract_epub_text(file_bytes, att_key)
             if chapters:
-                metadata['attachment_key'] = best_att['key']
+                metadata['attachment_key'] = att_key
                 metadata['attachment_type'] = 'epub'
                 chunks = chunk_epub(chapters, metadata)
         except Exception as e:
             logger.warning(f"Failed to extract EPUB for {item_key}: {e}")
 
-    elif best_att and att_type == 'snapshot':
+    elif att_type == 'snapshot':
         try:
-            html_bytes = zot.file(best_att['key'])
-            text = extract_html_text(html_bytes)
+            text = extract_html_text(file_bytes)
             if text.strip():
                 chunks = chunk_document(text, item_type, metadata)
         except Exception as e:
@@ -127,79 +199,240 @@ def process_item(zot, item, collection_tree):
                 meta_text += f" {metadata['archive']}."
             if metadata['tags']:
                 meta_text += f" Tags: {', '.join(metadata['tags'])}."
-            chunks = [{'text': meta_text, 'chunk_index': 0, 'total_chunks': 1, 'metadata': metadata}]
+            chunks = [Chunk(meta_text, 0, 1, metadata)]
 
     return chunks
 
 
-def index_items(items, zot, collection_tree, batch_size=50):
-    """Index a list of items: extract, chunk, embed, upsert to Pinecone."""
-    all_chunks = []
+def _download_attachment(item):
+    """Fetch an item's attachment with this thread's own Zotero client."""
+    return fetch_item_attachment(get_thread_zotero_client(), item)
+
+
+class _ExtractionPool:
+    """Process pool running chunk_item, with results taken in submission order.
+
+    An item whose extraction hangs past EXTRACT_TIMEOUT or crashes its worker
+    (e.g. a PDFium segfault) is skipped and the pool is replaced, so one bad
+    file cannot stall or abort the rest of the run.
+    """
+
+    def __init__(self):
+        self._pending = deque()  # [item, attachment, future]
+        self._pool = self._new_pool()
+
+    @staticmethod
+    def _new_pool():
+        # Download threads are busy in HTTP/SSL calls by the time workers start,
+        # so spawn them fresh rather than forking a copy of those threads' locks
+        return ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+        )
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, item, attachment):
+        self._pending.append([item, attachment, self._pool.submit(chunk_item, item, *attachment)])
+
+    def next_result(self):
+        """Wait for the oldest item and return (item, chunks); chunks is empty if it was skipped."""
+        item, attachment, future = self._pending.popleft()
+        try:
+            return item, future.result(timeout=EXTRACT_TIMEOUT)
+        except TimeoutError:
+            logger.warning(f"  Extraction of {item['key']} timed out after {EXTRACT_TIMEOUT}s, skipping")
+            self._restart()
+        except BrokenProcessPool:
+            # Any item in flight may have killed the worker; retry this one alone to find out
+            self._restart(resubmit=False)
+            try:
+                return item, self._pool.submit(chunk_item, item, *attachment).result(timeout=EXTRACT_TIMEOUT)
+            except (TimeoutError, BrokenProcessPool):
+                logger.warning(f"  Extraction of {item['key']} crashed or hung its worker, skipping")
+                self._restart(resubmit=False)
+            finally:
+                self._resubmit()
+        return item, []
+
+    def _terminate(self):
+        """Kill the workers, hung ones included, without waiting for them."""
+        # ProcessPoolExecutor has no public way to stop a busy worker before 3.14
+        for process in list((self._pool._processes or {}).values()):
+            process.terminate()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _restart(self, resubmit=True):
+        """Replace the pool with a fresh one."""
+        self._terminate()
+        self._pool = self._new_pool()
+        if resubmit:
+            self._resubmit()
+
+    def _resubmit(self):
+        """Send pending items whose future died with an old pool to the current one."""
+        for entry in self._pending:
+            future = entry[2]
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                entry[2] = self._pool.submit(chunk_item, entry[0], *entry[1])
+
+    def close(self):
+        if self._pending:
+            # Abandoned early (e.g. on an error); don't wait on work nobody will collect
+            self._terminate()
+        else:
+            self._pool.shutdown()
+
+
+def _chunk_items(items):
+    """Yield (item, chunks) for each item, in order.
+
+    Attachments are downloaded on a small thread pool and handed to a process
+    pool for extraction and chunking, so downloads of upcoming items overlap
+    with parsing of earlier ones and PDFs are parsed on all cores. At most a
+    few items per worker are in flight at once.
+    """
+    window = max(EXTRACT_WORKERS * 2, DOWNLOAD_WORKERS)
+    extractor = _ExtractionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as io_pool:
+            downloads = deque()
+
+            def _extract_next_download():
+                item, download = downloads.popleft()
+                # Submitted from this thread only; worker threads just download
+                # (pyzotero's request timeout bounds how long a download can block)
+                extractor.submit(item, download.result())
+
+            for i, item in enumerate(items):
+                title = item['data'].get('title', '')[:60]
+                logger.info(f"[{i+1}/{len(items)}] Processing: {title}")
+                downloads.append((item, io_pool.submit(_download_attachment, item)))
+                if len(downloads) >= DOWNLOAD_WORKERS:
+                    _extract_next_download()
+                if len(extractor) >= window:
+                    yield extractor.next_result()
+            while downloads:
+                _extract_next_download()
+            while extractor:
+                yield extractor.next_result()
+    finally:
+        extractor.close()
+
+
+def _embed_and_upsert(batch, replace_existing, memo):
+    """Embed one batch of chunks and upsert it to Pinecone.
+
+    memo is an OrderedDict of content hash -> embedding shared across batches.
+    """
+    texts = []
+    last_meta = header = None
+    for c in batch:
+        # Chunks of one item are contiguous and share base_meta, so build its header once
+        if c.base_meta is not last_meta:
+            last_meta = c.base_meta
+            header = _build_context_header(last_meta)
+        texts.append(header + c.text)
+    hashes = [_content_hash(t) for t in texts]
+    chunk_ids = [f"{c.base_meta['zotero_key']}_c{c.chunk_index}" for c in batch]
+
+    embeddings = [None] * len(batch)
+    if replace_existing:
+        existing = fetch_vectors(chunk_ids)
+        for j, (chunk_id, content_hash) in enumerate(zip(chunk_ids, hashes)):
+            stored = existing.get(chunk_id)
+            if stored and stored[1].get('content_hash') == content_hash:
+                embeddings[j] = stored[0]
+    for j, content_hash in enumerate(hashes):
+        if embeddings[j] is None and content_hash in memo:
+            embeddings[j] = memo[content_hash]
+            memo.move_to_end(content_hash)
+    missing = [j for j, e in enumerate(embeddings) if e is None]
+    if len(missing) < len(batch):
+        logger.info(f"  Reusing {len(batch) - len(missing)} unchanged or duplicate embeddings")
+    if missing:
+        # embed_texts sends each distinct text once, so duplicates within the batch are free
+        fresh = embed_texts([texts[j] for j in missing])
+        for j, embedding in zip(missing, fresh):
+            embeddings[j] = embedding
+            # Copy so a memoized row doesn't keep the whole batch array alive
+            memo[hashes[j]] = embedding.copy()
+        while len(memo) > EMBED_MEMO_SIZE:
+            memo.popitem(last=False)
+
+    vectors = []
+    last_meta = item_fields = None
+    for chunk, chunk_id, content_hash, embedding in zip(batch, chunk_ids, hashes, embeddings):
+        # Chunks of one item share base_meta, so its fields are flattened once per item
+        if chunk.base_meta is not last_meta:
+            last_meta = chunk.base_meta
+            item_fields = clean_metadata(_item_fields(last_meta))
+        flat_meta = {
+            **item_fields,
+            'text': chunk.text[:2000],
+            'chunk_index': chunk.chunk_index,
+            'total_chunks': chunk.total_chunks,
+            'page_start': chunk.page_start,
+            'page_end': chunk.page_end,
+            'pdf_page': chunk.pdf_page,
+            'content_hash': content_hash,
+        }
+        vectors.append((chunk_id, embedding, flat_meta))
+
+    # Item fields were cleaned above and the per-chunk fields are plain scalars
+    upsert_chunks(vectors, clean=False)
+
+
+def index_items(items, batch_size=1024, replace_existing=False, indexed_keys=()):
+    """Index a list of items: extract, chunk, embed, upsert to Pinecone.
+
+    Chunks are embedded and upserted in batches as items finish chunking, so
+    only about one batch of chunks is held in memory at a time.
+
+    With replace_existing, items are assumed to be indexed already: chunks
+    whose text is unchanged reuse their stored vector instead of being
+    re-embedded, and chunks left over from a longer old version are deleted
+    for the keys in indexed_keys (items that had chunks stored before).
+    """
+    buffer = []
+    chunk_counts = {}
     skipped = 0
     processed = 0
+    total_chunks = 0
+    batches = 0
+    memo = OrderedDict()
 
-    for i, item in enumerate(items):
-        title = item['data'].get('title', '')[:60]
-        logger.info(f"[{i+1}/{len(items)}] Processing: {title}")
-
-        chunks = process_item(zot, item, collection_tree)
+    for item, chunks in _chunk_items(items):
+        chunk_counts[item['key']] = len(chunks)
         if chunks:
-            all_chunks.extend(chunks)
+            buffer.extend(chunks)
             processed += 1
+            total_chunks += len(chunks)
         else:
             skipped += 1
-            logger.info(f"  -> skipped (no extractable content)")
-
-    logger.info(f"Processed {processed} items, skipped {skipped}, total chunks: {len(all_chunks)}")
-
-    if not all_chunks:
+            logger.info(f"  -> skipped {item['key']} (no extractable content)")
+        while len(buffer) >= batch_size:
+            batches += 1
+            _embed_and_upsert(buffer[:batch_size], replace_existing, memo)
+            del buffer[:batch_size]
+            logger.info(f"  Upserted batch {batches} ({batch_size} chunks)")
+    if buffer:
+        batches += 1
+        _embed_and_upsert(buffer, replace_existing, memo)
+        logger.info(f"  Upserted batch {batches} ({len(buffer)} chunks)")
+
+    logger.info(f"Processed {processed} items, skipped {skipped}, total chunks: {total_chunks}")
+
+    if not total_chunks:
         logger.info("No chunks to index.")
-        return
-
-    logger.info(f"Embedding {len(all_chunks)} chunks...")
-    for batch_start in range(0, len(all_chunks), batch_size):
-        batch = all_chunks[batch_start:batch_start + batch_size]
-        texts = [
-            _build_context_header(c['metadata']) + c['text']
-            for c in batch
-        ]
-        embeddings = embed_texts(texts)
-
-        vectors = []
-        for j, (chunk, embedding) in enumerate(zip(batch, embeddings)):
-            chunk_id = f"{chunk['metadata']['zotero_key']}_c{chunk['chunk_index']}"
-            source_type = chunk['metadata'].get('source_type', 'document')
-            flat_meta = {
-                'text': chunk['text'][:2000],
-                'zotero_key': chunk['metadata']['zotero_key'],
-                'title': chunk['metadata']['title'],
-                'authors': chunk['metadata']['authors'],
-                'item_type': chunk['metadata']['item_type'],
-                'date': chunk['metadata']['date'],
-                'archive': chunk['metadata'].get('archive', ''),
-                'archive_location': chunk['metadata'].get('archive_location', ''),
-                'tags': chunk['metadata']['tags'],
-                'collections': chunk['metadata']['collections'],
-                'archive_collection': chunk['metadata'].get('archive_collection', ''),
-                'chunk_index': chunk['chunk_index'],
-                'total_chunks': chunk['total_chunks'],
-                'source_type': source_type,
-                'page_start': chunk['metadata'].get('page_start', 0),
-                'page_end': chunk['metadata'].get('page_end', 0),
-                'page_count': chunk['metadata'].get('page_count', 0),
-                'pdf_page': chunk['metadata'].get('pdf_page', 0),
-            }
-            if 'attachment_key' in chunk['metadata']:
-                flat_meta['attachment_key'] = chunk['metadata']['attachment_key']
-            if 'attachment_type' in chunk['metadata']:
-                flat_meta['attachment_type'] = chunk['metadata']['attachment_type']
-            if 'chapter' in chunk['metadata']:
-                flat_meta['chapter'] = chunk['metadata']['chapter']
-
-            vectors.append((chunk_id, embedding, flat_meta))
-
-        upsert_chunks(vectors)
-        logger.info(f"  Upserted batch {batch_start//batch_size + 1} ({len(batch)} chunks)")
+        if not replace_existing:
+            return
+
+    if replace_existing:
+        for key, count in chunk_counts.items():
+            # New items have nothing stored past count, so skip the delete call
+            if key in indexed_keys:
+                delete_chunks_from(key, count)
 
     logger.info("Indexing complete.")
 
@@ -229,11 +462,11 @@ def run_full_index():
     items = get_all_items(zot, tree)
     logger.info(f"Found {len(items)} items")
 
-    index_items(items, zot, tree)
+    index_items(items)
 
     state = {
         'library_version': zot.last_modified_version(),
-        'indexed_keys': [i['key'] for i in items],
+        'indexed': {i['key']: i.get('version', 0) for i in items},
     }
     save_sync_state(state)
     logger.info(f"Sync state saved (version {state['library_version']})")
@@ -245,7 +478,7 @@ def run_incremental_update():
 
     state = load_sync_state()
     last_version = state.get('library_version', 0)
-    indexed_keys = set(state.get('indexed_keys', []))
+    indexed = state['indexed']
 
     logger.info(f"Last sync version: {last_version}")
 
@@ -260,31 +493,24 @@ def run_incremental_update():
         build_archive_aliases(tree)
 
     items = get_all_items(zot, tree)
-    current_keys = {i['key'] for i in items}
+    current = {i['key']: i.get('version', 0) for i in items}
 
-    removed = indexed_keys - current_keys
-    for key in removed:
+    for key in indexed.keys() - current.keys():
         logger.info(f"Removing deleted item: {key}")
         delete_by_zotero_key(key)
 
-    new_items = []
-    for item in items:
-        item_version = item.get('version', 0)
-        if item['key'] not in indexed_keys or item_version > last_version:
-            new_items.append(item)
+    # Unknown keys default to -1 so never-indexed items (even at version 0) are picked up
+    new_items = [i for i in items if indexed.get(i['key'], -1) < current[i['key']]]
 
     if new_items:
         logger.info(f"Indexing {len(new_items)} new/changed items...")
-        for item in new_items:
-            if item['key'] in indexed_keys:
-                delete_by_zotero_key(item['key'])
-        index_items(new_items, zot, tree)
+        index_items(new_items, replace_existing=True, indexed_keys=indexed)
     else:
         logger.info("No new items to index.")
 
     state = {
         'library_version': zot.last_modified_version(),
-        'indexed_keys': list(current_keys),
+        'indexed': current,
     }
     save_sync_state(state)
     logger.info("Sync state updated.")
@@ -3,14 +3,13 @@
 Used by both the MCP server (server.py) and the web app (webapp.py).
 """
 
-import json
 import logging
 import re
 
-from flashrank import Ranker, RerankRequest
+import orjson
 
-from src.config import ARCHIVE_ALIASES_FILE
-from src.embeddings import init_embeddings, embed_query
+from src.config import ARCHIVE_ALIASES_FILE, QUERY_WARMUP_FILE
+from src.embeddings import init_embeddings, embed_query, warmup_query_cache
 from src.vectordb import init_pinecone, search, get_index_stats
 
 logger = logging.getLogger(__name__)
@@ -20,24 +19,43 @@ _archive_aliases = {}
 _ranker = None
 
 _SHORTHAND_KEYS = {'type', 'by', 'tag', 'in', 'from', 'to', 'collection', 'top'}
+_SHORTHAND_RE = re.compile(
+    r'\b(' + '|'.join(sorted(_SHORTHAND_KEYS)) + r'):(=?)(\"[^\"]+\"|\'[^\']+\'|\S+)'
+)
+_MULTI_SPACE_RE = re.compile(r'\s{2,}')
+
+# The reranker's MiniLM model only sees ~512 tokens, so longer passages are cut here
+RERANK_MAX_CHARS = 1500
 
 
 def init_pipeline():
-    """Initialize embeddings, Pinecone, archive aliases, and reranker."""
-    global _initialized, _archive_aliases, _ranker
+    """Initialize embeddings, Pinecone, archive aliases, query cache, and reranker."""
+    global _initialized, _ranker
     if _initialized:
         return
     init_embeddings()
     init_pinecone()
-    if ARCHIVE_ALIASES_FILE.exists():
-        data = json.loads(ARCHIVE_ALIASES_FILE.read_text())
-        _archive_aliases = {k.lower(): v for k, v in data.get('aliases', {}).items()}
-        logger.info(f"Loaded {len(_archive_aliases)} archive aliases")
+    load_archive_aliases()
+    if QUERY_WARMUP_FILE.exists():
+        warmup_query_cache(orjson.loads(QUERY_WARMUP_FILE.read_bytes()))
+    # Imported here so callers that never search (e.g. --stats) skip loading it
+    from flashrank import Ranker
     _ranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="/tmp/flashrank")
     logger.info("Flashrank reranker initialized")
     _initialized = True
 
 
+def load_archive_aliases():
+    """(Re)load archive aliases from ARCHIVE_ALIASES_FILE, e.g. after a re-index rewrote it."""
+    global _archive_aliases
+    if not ARCHIVE_ALIASES_FILE.exists():
+        _archive_aliases = {}
+        return
+    data = orjson.loads(ARCHIVE_ALIASES_FILE.read_bytes())
+    _archive_aliases = {k.lower(): v for k, v in data.get('aliases', {}).items()}
+    logger.info(f"Loaded {len(_archive_aliases)} archive aliases")
+
+
 def get_archive_aliases():
     """Return the loaded archive aliases dict (lowercase key -> canonical name)."""
     return dict(_archive_aliases)
@@ -52,7 +70,6 @@ def parse_shorthand(query):
     Returns (cleaned_query, dict_of_filters).
     """
     filters = {}
-    pattern = r'\b(' + '|'.join(_SHORTHAND_KEYS) + r'):(=?)(\"[^\"]+\"|\'[^\']+\'|\S+)'
 
     def _replace(m):
         key = m.group(1)
@@ -61,32 +78,34 @@ def parse_shorthand(query):
         filters[key] = ('=' + val) if exact else val
         return ''
 
-    cleaned = re.sub(pattern, _replace, query)
-    cleaned = re.sub(r'\s{2,}', ' ', cleaned).strip()
+    cleaned = _SHORTHAND_RE.sub(_replace, query)
+    cleaned = _MULTI_SPACE_RE.sub(' ', cleaned).strip()
     return cleaned, filters
 
 
-def _match_filter(filter_val, target):
-    """Match a filter value against a target string."""
-    if not target:
-        return False
+def _parse_filter(filter_val):
+    """Split a filter value into (exact, lowercased value); a leading = means exact match."""
     if filter_val.startswith('='):
-        return filter_val[1:].lower() == target.lower()
-    return filter_val.lower() in target.lower()
+        return True, filter_val[1:].lower()
+    return False, filter_val.lower()
 
 
-def _match_archive(filter_val, archive_collection):
-    """Match an archive filter against an item's archive_collection."""
-    if not archive_collection:
-        return False
-    exact = filter_val.startswith('=')
-    raw_val = filter_val[1:] if exact else filter_val
-    canonical = _archive_aliases.get(raw_val.lower())
+def _parse_archive_filter(filter_val):
+    """Like _parse_filter, but a known alias becomes an exact match on its archive name."""
+    exact, value = _parse_filter(filter_val)
+    canonical = _archive_aliases.get(value)
     if canonical:
-        return archive_collection.lower() == canonical.lower()
-    if exact:
-        return raw_val.lower() == archive_collection.lower()
-    return raw_val.lower() in archive_collection.lower()
+        return True, canonical.lower()
+    return exact, value
+
+
+def _match_filter(parsed, target):
+    """Match a filter from _parse_filter against a target string."""
+    if not target:
+        return False
+    exact, value = parsed
+    target = target.lower()
+    return value == target if exact else value in target
 
 
 def run_search(query_str, top_k=10, item_type=None, author=None, tag=None,
@@ -125,16 +144,21 @@ def run_search(query_str, top_k=10, item_type=None, author=None, tag=None,
     results = search(query_embedding, top_k=search_k, filters=pinecone_filter)
 
     if needs_client_filter:
+        # Lowercase and resolve each filter once per query rather than once per result
+        author_f = author and _parse_filter(author)
+        tag_f = tag and _parse_filter(tag)
+        collection_f = collection and _parse_filter(collection)
+        archive_f = archive and _parse_archive_filter(archive)
         filtered = []
         for r in results:
             meta = r['metadata']
-            if author and not _match_filter(author, ' '.join(meta.get('authors', []))):
+            if author_f and not _match_filter(author_f, ' '.join(meta.get('authors', ()))):
                 continue
-            if tag and not any(_match_filter(tag, t) for t in meta.get('tags', [])):
+            if tag_f and not any(_match_filter(tag_f, t) for t in meta.get('tags', ())):
                 continue
-            if collection and not any(_match_filter(collection, c) for c in meta.get('collections', [])):
+            if collection_f and not any(_match_filter(collection_f, c) for c in meta.get('collections', ())):
                 continue
-            if archive and not _match_archive(archive, meta.get('archive_collection', '')):
+            if archive_f and not _match_filter(archive_f, meta.get('archive_collection', '')):
                 continue
             if date_from and meta.get('date', '') and meta['date'] < date_from:
                 continue
@@ -144,8 +168,10 @@ def run_search(query_str, top_k=10, item_type=None, author=None, tag=None,
         results = filtered
 
     if results and _ranker:
+        from flashrank import RerankRequest
+        # Slicing returns the same str object when the text already fits
         passages = [
-            {"id": i, "text": r['metadata'].get('text', '')[:1500]}
+            {"id": i, "text": (r['metadata'].get('text') or '')[:RERANK_MAX_CHARS]}
             for i, r in enumerate(results)
         ]
         rerank_req = RerankRequest(query=query, passages=passages)
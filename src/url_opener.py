@@ -0,0 +1,36 @@
+"""Open zotero:// URLs with the platform's URL handler."""
+
+import os
+import sys
+import threading
+
+_OPENER = 'open' if sys.platform == "darwin" else 'xdg-open'
+
+# Spawned opener processes that have not been waited on yet
+_children = []
+_lock = threading.Lock()
+
+
+def _reap_children():
+    """Collect opener processes that have exited so they don't linger as zombies."""
+    for pid in list(_children):
+        try:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done = pid
+        if done:
+            _children.remove(pid)
+
+
+def open_url(url):
+    """Hand a URL to the OS without waiting for the handler to finish.
+
+    Uses posix_spawnp rather than subprocess.Popen to skip the Popen object
+    and its pipe setup; finished children are reaped on the next call.
+    """
+    if sys.platform == "win32":
+        os.startfile(url)
+        return
+    with _lock:
+        _reap_children()
+        _children.append(os.posix_spawnp(_OPENER, [_OPENER, url], os.environ))
@@ -1,8 +1,16 @@
 """Pinecone vector database operations."""
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from pinecone import Pinecone, ServerlessSpec
 
+try:
+    # Protobuf over HTTP/2 instead of JSON over REST; needs the pinecone[grpc] extra
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+
 from src.config import PINECONE_API_KEY, PINECONE_INDEX_NAME, EMBEDDING_DIMENSION
 
 logger = logging.getLogger(__name__)
@@ -10,6 +18,8 @@ logger = logging.getLogger(__name__)
 _pc = None
 _index = None
 
+UPSERT_MAX_WORKERS = 8
+
 
 def init_pinecone(dimension=None):
     """Initialize Pinecone client and ensure index exists.
@@ -23,7 +33,10 @@ def init_pinecone(dimension=None):
 
     dim = dimension or EMBEDDING_DIMENSION
 
-    _pc = Pinecone(api_key=PINECONE_API_KEY)
+    if PineconeGRPC is not None:
+        _pc = PineconeGRPC(api_key=PINECONE_API_KEY)
+    else:
+        _pc = Pinecone(api_key=PINECONE_API_KEY)
 
     existing = [idx.name for idx in _pc.list_indexes()]
     if PINECONE_INDEX_NAME not in existing:
@@ -40,30 +53,39 @@ def init_pinecone(dimension=None):
     return _index
 
 
-def upsert_chunks(chunks_with_embeddings):
+def upsert_chunks(chunks_with_embeddings, clean=True):
     """Upsert chunks with their embeddings into Pinecone.
 
     Args:
-        chunks_with_embeddings: list of (chunk_id, embedding_vector, metadata_dict)
+        chunks_with_embeddings: list of (chunk_id, embedding_vector, metadata_dict);
+            vectors may be lists or float32 arrays
+        clean: pass metadata through clean_metadata; False if the caller already did
     """
     BATCH_SIZE = 100
+    batches = []
     for i in range(0, len(chunks_with_embeddings), BATCH_SIZE):
         batch = chunks_with_embeddings[i:i + BATCH_SIZE]
         vectors = []
         for chunk_id, embedding, metadata in batch:
-            clean_meta = _clean_metadata(metadata)
             vectors.append({
                 'id': chunk_id,
-                'values': embedding,
-                'metadata': clean_meta,
+                'values': _as_list(embedding),
+                'metadata': clean_metadata(metadata) if clean else metadata,
             })
-        _index.upsert(vectors=vectors)
+        batches.append(vectors)
+
+    if len(batches) == 1:
+        _index.upsert(vectors=batches[0])
+        return
+    # Overlap the round-trips; list() waits for every batch and re-raises failures
+    with ThreadPoolExecutor(max_workers=UPSERT_MAX_WORKERS) as executor:
+        list(executor.map(lambda vectors: _index.upsert(vectors=vectors), batches))
 
 
 def search(query_embedding, top_k=10, filters=None):
     """Search for similar chunks."""
     kwargs = {
-        'vector': query_embedding,
+        'vector': _as_list(query_embedding),
         'top_k': top_k,
         'include_metadata': True,
     }
@@ -81,17 +103,41 @@ def search(query_embedding, top_k=10, filters=None):
     ]
 
 
+def fetch_vectors(ids):
+    """Fetch stored vectors by chunk id.
+
+    Returns dict mapping chunk_id -> (values, metadata) for the ids that exist.
+    """
+    BATCH_SIZE = 100
+    found = {}
+    for i in range(0, len(ids), BATCH_SIZE):
+        response = _index.fetch(ids=ids[i:i + BATCH_SIZE])
+        for chunk_id, vector in response.vectors.items():
+            found[chunk_id] = (vector.values, vector.metadata or {})
+    return found
+
+
 def delete_by_zotero_key(zotero_key):
     """Delete all chunks for a given Zotero item key."""
     _index.delete(filter={'zotero_key': zotero_key})
 
 
+def delete_chunks_from(zotero_key, chunk_index):
+    """Delete the chunks of an item from chunk_index onwards (left over from a longer version)."""
+    _index.delete(filter={'zotero_key': zotero_key, 'chunk_index': {'$gte': chunk_index}})
+
+
 def get_index_stats():
     """Get stats about the current index."""
     return _index.describe_index_stats()
 
 
-def _clean_metadata(metadata):
+def _as_list(vector):
+    """Convert a NumPy vector to the plain float list the Pinecone client expects."""
+    return vector.tolist() if hasattr(vector, 'tolist') else vector
+
+
+def clean_metadata(metadata):
     """Ensure all metadata values are Pinecone-compatible types."""
     clean = {}
     for k, v in metadata.items():
@@ -100,7 +146,11 @@ def _clean_metadata(metadata):
         if isinstance(v, (str, int, float, bool)):
             clean[k] = v
         elif isinstance(v, list):
-            clean[k] = [str(x) for x in v if x]
+            if all(type(x) is str for x in v):
+                # The usual case (authors, tags, collections): only drop empty strings
+                clean[k] = v if all(v) else [x for x in v if x]
+            else:
+                clean[k] = [str(x) for x in v if x]
         else:
             clean[k] = str(v)
     return clean
@@ -1,11 +1,29 @@
 """Zotero API client and collection hierarchy mapper."""
 
+import math
 import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 from pyzotero import zotero
 from src.config import (
     ZOTERO_LIBRARY_ID, ZOTERO_API_KEY, ZOTERO_LIBRARY_TYPE, COLLECTION_KEY,
 )
 
+# Items per request when paging through listings (pyzotero's default and the API maximum)
+ZOTERO_PAGE_SIZE = 100
+
+# Collections fetched at once; kept low to stay well inside Zotero's rate limits
+COLLECTION_FETCH_WORKERS = 4
+# Pages of one long listing fetched at once, for the same reason
+PAGE_FETCH_WORKERS = 3
+
+_thread_local = threading.local()
+
+# Visit dates in collection names (e.g., "DTRP: 2025/12/17")
+_VISIT_DATE_RE = re.compile(r'(\d{4}/\d{2}/\d{2})')
+
 
 def get_zotero_client():
     if not ZOTERO_LIBRARY_ID or not ZOTERO_API_KEY:
@@ -16,6 +34,14 @@ def get_zotero_client():
     return zotero.Zotero(ZOTERO_LIBRARY_ID, ZOTERO_LIBRARY_TYPE, ZOTERO_API_KEY)
 
 
+def get_thread_zotero_client():
+    """Return this thread's Zotero client; pyzotero clients are not thread-safe."""
+    zot = getattr(_thread_local, 'zot', None)
+    if zot is None:
+        zot = _thread_local.zot = get_zotero_client()
+    return zot
+
+
 def build_collection_tree(zot, root_key=None):
     """Build a complete tree of a collection and all subcollections.
 
@@ -35,71 +61,80 @@ def build_collection_tree(zot, root_key=None):
     if not root_key:
         return {}
 
-    coll_lookup = {}
-
-    def _discover(parent_key):
-        subs = zot.collections_sub(parent_key)
-        for c in subs:
-            if c['key'] not in coll_lookup:
-                coll_lookup[c['key']] = {
-                    'name': c['data']['name'],
-                    'parent_key': c['data'].get('parentCollection', None),
-                }
-                _discover(c['key'])
+    # One paginated listing of every collection replaces a collections_sub
+    # request per collection in the subtree
+    all_colls = zot.everything(zot.collections())
+    children = {}
+    for c in all_colls:
+        children.setdefault(c['data'].get('parentCollection') or None, []).append(c)
 
-    _discover(root_key)
+    # Depth-first from the root, visiting children in listing order
+    coll_lookup = {}
+    stack = list(reversed(children.get(root_key, [])))
+    while stack:
+        c = stack.pop()
+        if c['key'] in coll_lookup:
+            continue
+        coll_lookup[c['key']] = {
+            'name': c['data']['name'],
+            'parent_key': c['data']['parentCollection'],
+        }
+        stack.extend(reversed(children.get(c['key'], [])))
 
     # Add the root collection
-    root = zot.collection(root_key)
+    root = next((c for c in all_colls if c['key'] == root_key), None)
+    if root is None:
+        root = zot.collection(root_key)
     coll_lookup[root_key] = {
         'name': root['data']['name'],
         'parent_key': None,
     }
 
-    # Build paths by walking up the tree
+    # Build paths from the parent's path, so each ancestor chain is walked once
+    path_cache = {}
+
     def get_path(key):
-        path = []
-        current = key
-        while current and current in coll_lookup:
-            path.append(coll_lookup[current]['name'])
-            current = coll_lookup[current]['parent_key']
-        path.reverse()
+        path = path_cache.get(key)
+        if path is None:
+            parent = coll_lookup[key]['parent_key']
+            parent_path = get_path(parent) if parent in coll_lookup else []
+            path = path_cache[key] = parent_path + [coll_lookup[key]['name']]
         return path
 
-    # Parse visit dates from collection names (e.g., "DTRP: 2025/12/17")
-    visit_date_pattern = re.compile(r'(\d{4}/\d{2}/\d{2})')
-
     # Auto-detect archive collections: any collection that is a direct child of
     # the root and has subcollections is treated as an "archive" collection.
     # This generalizes the approach — no hardcoded archive list needed.
+    child_count = Counter(data['parent_key'] for data in coll_lookup.values())
     archive_keys = {}
     for key, data in coll_lookup.items():
-        if data['parent_key'] == root_key:
-            # Check if this collection has subcollections
-            has_children = any(
-                v['parent_key'] == key for v in coll_lookup.values()
-            )
-            if has_children:
-                archive_keys[key] = data['name']
+        if data['parent_key'] == root_key and child_count[key]:
+            archive_keys[key] = data['name']
+
+    # Enclosing archive collection of each key, taken from the parent's like the paths
+    archive_cache = {}
+
+    def get_archive(key):
+        if key not in archive_cache:
+            parent = coll_lookup[key]['parent_key']
+            if key in archive_keys:
+                archive_cache[key] = archive_keys[key]
+            elif parent in coll_lookup:
+                archive_cache[key] = get_archive(parent)
+            else:
+                archive_cache[key] = None
+        return archive_cache[key]
 
     result = {}
     for key, data in coll_lookup.items():
         path = get_path(key)
+        archive_name = get_archive(key)
 
-        # Determine archive name: walk up the path to find the archive collection
-        archive_name = None
-        current = key
-        while current and current in coll_lookup:
-            if current in archive_keys:
-                archive_name = archive_keys[current]
-                break
-            current = coll_lookup[current]['parent_key']
-
-        # Parse visit date from name
+        # Parse visit date from name; most names have no '/' and skip the regex
         visit_date = None
-        match = visit_date_pattern.search(data['name'])
-        if match:
-            visit_date = match.group(1)
+        if '/' in data['name']:
+            match = _VISIT_DATE_RE.search(data['name'])
+            if match:
+                visit_date = match.group(1)
 
         result[key] = {
             'name': data['name'],
@@ -112,30 +147,71 @@ def build_collection_tree(zot, root_key=None):
     return result
 
 
+def _fetch_pages(zot, fetch_page):
+    """Fetch every page of a listing, requesting pages after the first concurrently.
+
+    fetch_page(client, start) returns the page of up to ZOTERO_PAGE_SIZE items
+    starting at offset start. The first page's Total-Results header gives the
+    remaining offsets; each worker thread uses its own client.
+    """
+    first = fetch_page(zot, 0)
+    total = zot.request.headers.get('Total-Results') if zot.request is not None else None
+    if total is None:
+        # No total to plan from; follow the 'next' links one page at a time
+        return zot.everything(first)
+    starts = range(ZOTERO_PAGE_SIZE, int(total), ZOTERO_PAGE_SIZE)
+    if not starts:
+        return first
+    with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
+        pages = executor.map(lambda start: fetch_page(get_thread_zotero_client(), start), starts)
+        return first + [item for page in pages for item in page]
+
+
+def _top_items_page(client, start):
+    return client.top(start=start, limit=ZOTERO_PAGE_SIZE)
+
+
+def _library_scan_is_cheaper(zot, collection_tree):
+    """Whether paging through the whole library takes fewer requests than one listing per collection."""
+    pages = math.ceil(zot.num_items() / ZOTERO_PAGE_SIZE)
+    return pages + 1 < len(collection_tree)
+
+
 def get_all_items(zot, collection_tree):
     """Fetch all items from the target collection(s).
 
     If collection_tree is populated, fetches from each subcollection and
-    deduplicates. Otherwise, fetches the entire library.
+    deduplicates, or scans the library and keeps items in the tree when
+    that needs fewer requests. Otherwise, fetches the entire library.
 
     Returns list of items with enriched metadata including collection info.
     """
     seen_keys = set()
     all_top_level = []
 
-    if collection_tree:
-        collection_keys = list(collection_tree.keys())
-        for coll_key in collection_keys:
-            items = zot.everything(zot.collection_items(coll_key))
-            for item in items:
-                if item['data']['itemType'] in ('attachment', 'note'):
-                    continue
-                if item['key'] not in seen_keys:
-                    seen_keys.add(item['key'])
-                    all_top_level.append(item)
+    if collection_tree and _library_scan_is_cheaper(zot, collection_tree):
+        # Items carry their collection keys, so one pass over the library
+        # and a local filter replaces a listing per collection
+        listings = [[
+            item for item in _fetch_pages(zot, _top_items_page)
+            if not collection_tree.keys().isdisjoint(item['data'].get('collections', ()))
+        ]]
+    elif collection_tree:
+        def _fetch(coll_key):
+            client = get_thread_zotero_client()
+            return client.everything(client.collection_items(coll_key))
+
+        # Each collection is a separate paginated listing, so fetch several at
+        # once; map() keeps collection order so deduplication is deterministic.
+        # Every collection in the tree is needed: the API's collection items
+        # listing does not include items that are only in subcollections.
+        with ThreadPoolExecutor(max_workers=COLLECTION_FETCH_WORKERS) as executor:
+            listings = list(executor.map(_fetch, collection_tree))
     else:
         # No collection specified — index entire library
-        items = zot.everything(zot.top())
+        listings = [_fetch_pages(zot, _top_items_page)]
+
+    for items in listings:
         for item in items:
             if item['data']['itemType'] in ('attachment', 'note'):
                 continue
@@ -151,17 +227,17 @@ def get_all_items(zot, collection_tree):
         visit_date = None
 
         for ck in item_colls:
-            if ck in collection_tree:
-                ct = collection_tree[ck]
-                coll_info.append({
-                    'key': ck,
-                    'name': ct['name'],
-                    'path': ct['path'],
-                })
-                if ct['archive_name'] and not archive_name:
-                    archive_name = ct['archive_name']
-                if ct['visit_date'] and not visit_date:
-                    visit_date = ct['visit_date']
+            ct = collection_tree.get(ck)
+            if ct is None:
+                continue
+            coll_info.append({
+                'key': ck,
+                'name': ct['name'],
+                'path': ct['path'],
+            })
+            # First collection that has each wins; every collection is still listed above
+            archive_name = archive_name or ct['archive_name']
+            visit_date = visit_date or ct['visit_date']
 
         item['_rag'] = {
             'zotero_collections': coll_info,
@@ -10,17 +10,19 @@ Usage:
 Then open http://localhost:5001 in your browser.
 """
 
-import json
+import asyncio
 import logging
-import os
-import subprocess
-import sys
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Optional
 
+import httpx
+import orjson
 from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, HTMLResponse, Response
 
 from src.config import (
     LLM_PROVIDER, ANTHROPIC_API_KEY, ANTHROPIC_MODEL,
@@ -28,13 +30,35 @@ from src.config import (
     OLLAMA_BASE_URL, OLLAMA_CHAT_MODEL,
     ARCHIVE_ALIASES_FILE,
 )
-from src.search_pipeline import init_pipeline, run_search, get_archive_aliases
+from src.search_pipeline import (
+    init_pipeline, run_search, get_archive_aliases, load_archive_aliases,
+)
+from src.url_opener import open_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Streamed LLM text is sent in pieces of up to this many characters, or
+# whatever arrived within this many seconds, rather than one SSE frame per token
+STREAM_FLUSH_CHARS = 256
+STREAM_FLUSH_SECONDS = 0.025
+
+# Long reads for slow generations, but fail fast if the provider is unreachable
+LLM_TIMEOUT = 300
+LLM_CONNECT_TIMEOUT = 5
+
+# Pooled so consecutive chats reuse the connection to the local Ollama server
+_ollama_http = httpx.AsyncClient(
+    base_url=OLLAMA_BASE_URL,
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+)
+
+# Hosted LLM clients, created on first use by _get_anthropic_client/_get_openai_client
+_anthropic_client = None
+_openai_client = None
+
 SYSTEM_PROMPT = """You are a research assistant helping a scholar with their research. You answer questions using ONLY the provided source documents.
 
 Rules:
@@ -48,130 +72,183 @@ Rules:
 The user may ask follow-up questions -- use conversation context plus any new sources provided."""
 
 
+@dataclass(slots=True)
+class SourceView:
+    """The fields of one search result that the client and the LLM context both show."""
+    title: str
+    authors: list
+    date: str
+    item_type: str
+    archive: str
+    archive_location: str
+    page_start: int
+    page_end: int
+    text: str
+    zotero_url: str
+    score: float
+    rerank_score: Optional[float]
+
+    @classmethod
+    def from_result(cls, result):
+        """Read a search result dict's metadata once."""
+        meta = result['metadata']
+        attachment_key = meta.get('attachment_key', '')
+        attachment_type = meta.get('attachment_type', 'pdf')
+        zotero_key = meta.get('zotero_key', '')
+        pdf_page = meta.get('pdf_page', meta.get('page_start', 0))
+
+        zotero_url = ''
+        if attachment_key:
+            zotero_url = f"/zotero/pdf/{attachment_key}"
+            if pdf_page and attachment_type == 'pdf':
+                zotero_url += f"?page={pdf_page}"
+        elif zotero_key:
+            zotero_url = f"/zotero/item/{zotero_key}"
+
+        rerank_score = result.get('rerank_score')
+        return cls(
+            title=meta.get('title', 'Untitled'),
+            authors=meta.get('authors', []),
+            date=meta.get('date', ''),
+            item_type=meta.get('item_type', ''),
+            archive=meta.get('archive', ''),
+            archive_location=meta.get('archive_location', ''),
+            page_start=meta.get('page_start', 0),
+            page_end=meta.get('page_end', 0),
+            text=meta.get('text', ''),
+            zotero_url=zotero_url,
+            score=float(result.get('score', 0)),
+            rerank_score=float(rerank_score) if rerank_score is not None else None,
+        )
+
+    def to_client(self):
+        """The dict sent to the frontend, with a shortened text preview."""
+        return {
+            'title': self.title,
+            'authors': self.authors,
+            'date': self.date,
+            'item_type': self.item_type,
+            'archive': self.archive,
+            'archive_location': self.archive_location,
+            'page_start': self.page_start,
+            'page_end': self.page_end,
+            'text': self.text[:600],
+            'zotero_url': self.zotero_url,
+            'score': self.score,
+            'rerank_score': self.rerank_score,
+        }
+
+
 def _build_source_context(sources):
-    """Format search results into a context block for the LLM."""
+    """Format SourceViews into a context block for the LLM."""
     if not sources:
         return "\n[No sources found for this query.]\n"
     parts = ["\n--- BEGIN SOURCES ---"]
     for i, s in enumerate(sources, 1):
-        authors = ', '.join(s.get('authors', [])) or 'Unknown'
-        title = s.get('title', 'Untitled')
-        date = s.get('date', '')
-        item_type = s.get('item_type', '')
-        text = s.get('text', '')
-
-        page_start = s.get('page_start', 0)
-        page_end = s.get('page_end', 0)
+        authors = ', '.join(s.authors) or 'Unknown'
+
         page_str = ''
-        if page_start > 0:
-            page_str = f", pp. {page_start}-{page_end}" if page_end > page_start else f", p. {page_start}"
+        if s.page_start > 0:
+            if s.page_end > s.page_start:
+                page_str = f", pp. {s.page_start}-{s.page_end}"
+            else:
+                page_str = f", p. {s.page_start}"
 
-        archive = s.get('archive', '')
-        archive_loc = s.get('archive_location', '')
         archive_str = ''
-        if archive:
-            archive_str = f"\nArchive: {archive}"
-            if archive_loc:
-                archive_str += f", {archive_loc}"
+        if s.archive:
+            archive_str = f"\nArchive: {s.archive}"
+            if s.archive_location:
+                archive_str += f", {s.archive_location}"
 
         parts.append(
-            f"\n[{i}] \"{title}\" -- {authors}"
-            f"{' (' + date + ')' if date else ''}{page_str}"
-            f"\nType: {item_type}{archive_str}"
-            f"\n{text}\n"
+            f"\n[{i}] \"{s.title}\" -- {authors}"
+            f"{' (' + s.date + ')' if s.date else ''}{page_str}"
+            f"\nType: {s.item_type}{archive_str}"
+            f"\n{s.text}\n"
         )
     parts.append("--- END SOURCES ---\n")
     return '\n'.join(parts)
 
 
-def _format_source_for_client(result):
-    """Convert a search result dict into the format sent to the frontend."""
-    meta = result['metadata']
-    attachment_key = meta.get('attachment_key', '')
-    attachment_type = meta.get('attachment_type', 'pdf')
-    zotero_key = meta.get('zotero_key', '')
-    pdf_page = meta.get('pdf_page', meta.get('page_start', 0))
-
-    zotero_url = ''
-    if attachment_key:
-        zotero_url = f"/zotero/pdf/{attachment_key}"
-        if pdf_page and attachment_type == 'pdf':
-            zotero_url += f"?page={pdf_page}"
-    elif zotero_key:
-        zotero_url = f"/zotero/item/{zotero_key}"
-
-    return {
-        'title': meta.get('title', 'Untitled'),
-        'authors': meta.get('authors', []),
-        'date': meta.get('date', ''),
-        'item_type': meta.get('item_type', ''),
-        'archive': meta.get('archive', ''),
-        'archive_location': meta.get('archive_location', ''),
-        'page_start': meta.get('page_start', 0),
-        'page_end': meta.get('page_end', 0),
-        'text': meta.get('text', '')[:600],
-        'zotero_url': zotero_url,
-        'score': float(result.get('score', 0)),
-        'rerank_score': float(result['rerank_score']) if result.get('rerank_score') is not None else None,
-    }
+def _get_anthropic_client():
+    """Create the Anthropic client on first use and reuse it (and its connections) after."""
+    global _anthropic_client
+    if _anthropic_client is None:
+        import anthropic
+        _anthropic_client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            timeout=anthropic.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+    return _anthropic_client
 
 
-def _stream_anthropic(messages, system_prompt):
+def _get_openai_client():
+    """Create the OpenAI client on first use and reuse it (and its connections) after."""
+    global _openai_client
+    if _openai_client is None:
+        import openai
+        _openai_client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=openai.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+    return _openai_client
+
+
+async def _stream_anthropic(messages, system_prompt):
     """Stream response from Anthropic Claude."""
-    import anthropic
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-    with client.messages.stream(
+    client = _get_anthropic_client()
+    async with client.messages.stream(
         model=ANTHROPIC_MODEL,
         max_tokens=4096,
         system=system_prompt,
         messages=messages,
     ) as stream:
-        for text in stream.text_stream:
+        async for text in stream.text_stream:
             yield text
 
 
-def _stream_openai(messages, system_prompt):
+async def _stream_openai(messages, system_prompt):
     """Stream response from OpenAI."""
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = _get_openai_client()
     full_messages = [{"role": "system", "content": system_prompt}] + messages
-    stream = client.chat.completions.create(
+    stream = await client.chat.completions.create(
         model=OPENAI_CHAT_MODEL,
         messages=full_messages,
         max_tokens=4096,
         stream=True,
     )
-    for chunk in stream:
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
         delta = chunk.choices[0].delta
         if delta.content:
             yield delta.content
 
 
-def _stream_ollama(messages, system_prompt):
+async def _stream_ollama(messages, system_prompt):
     """Stream response from Ollama (local)."""
-    import urllib.request
     full_messages = [{"role": "system", "content": system_prompt}] + messages
-    payload = json.dumps({
+    payload = {
         "model": OLLAMA_CHAT_MODEL,
         "messages": full_messages,
         "stream": True,
-    }).encode()
-    req = urllib.request.Request(
-        f"{OLLAMA_BASE_URL}/api/chat",
-        data=payload,
-        headers={"Content-Type": "application/json"},
-    )
-    with urllib.request.urlopen(req, timeout=300) as resp:
-        for line in resp:
-            if line.strip():
-                data = json.loads(line)
-                content = data.get("message", {}).get("content", "")
-                if content:
-                    yield content
+    }
+    async with _ollama_http.stream("POST", "/api/chat", json=payload) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.strip():
+                continue
+            data = orjson.loads(line)
+            message = data.get("message")
+            if message and message.get("content"):
+                yield message["content"]
+            if data.get("done"):
+                # The final line only carries timing stats
+                break
 
 
 def _get_llm_stream(messages, system_prompt):
-    """Get the appropriate LLM stream based on config."""
+    """Get the appropriate LLM stream (an async iterator of text deltas) based on config."""
     provider = LLM_PROVIDER.lower()
     if provider == "anthropic":
         return _stream_anthropic(messages, system_prompt)
@@ -181,33 +258,106 @@ def _get_llm_stream(messages, system_prompt):
         return _stream_openai(messages, system_prompt)
 
 
+async def _coalesce(deltas, max_delay=STREAM_FLUSH_SECONDS, max_chars=STREAM_FLUSH_CHARS):
+    """Merge text deltas into larger pieces for fewer SSE frames.
+
+    A piece is emitted once it reaches max_chars, or max_delay seconds after
+    its first delta arrived, so slow streams still show up promptly.
+    """
+    loop = asyncio.get_running_loop()
+    deltas = deltas.__aiter__()
+    buf = []
+    size = 0
+    deadline = None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(deltas.__anext__())
+            timeout = max(0, deadline - loop.time()) if buf else None
+            # asyncio.wait leaves the pending read running when the window closes
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield ''.join(buf)
+                buf, size = [], 0
+                continue
+            read, pending = pending, None
+            try:
+                text = read.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Deliver what already arrived before the error frame
+                if buf:
+                    yield ''.join(buf)
+                raise
+            if not buf:
+                deadline = loop.time() + max_delay
+            buf.append(text)
+            size += len(text)
+            if size >= max_chars:
+                yield ''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield ''.join(buf)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def _sse(event):
+    """Encode an event as a server-sent events frame, ready to send as bytes."""
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+_SSE_DONE = _sse({'type': 'done'})
+
+
 @app.get("/")
 async def index():
     return FileResponse("static/index.html")
 
 
+_ITEM_TYPES = [
+    'book', 'bookSection', 'conferencePaper', 'document',
+    'hearing', 'journalArticle', 'letter', 'manuscript',
+    'newspaperArticle', 'report', 'statute', 'thesis', 'webpage',
+]
+
+# (aliases file mtime, encoded /api/filters body); rebuilt when the file changes
+_filters_cache = (None, None)
+
+
+def _aliases_mtime():
+    try:
+        return ARCHIVE_ALIASES_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 @app.get("/api/filters")
 async def filters():
     """Return available filter values for sidebar dropdowns."""
-    aliases = get_archive_aliases()
-
-    archive_options = []
-    for acronym, full_name in sorted(aliases.items(), key=lambda x: x[1]):
-        archive_options.append({
-            'value': acronym,
-            'label': f"{acronym.upper()} -- {full_name}",
+    global _filters_cache
+    mtime = _aliases_mtime()
+    cached_mtime, body = _filters_cache
+    if body is None or mtime != cached_mtime:
+        # Picks up an aliases file rewritten by a re-index while the app is running
+        load_archive_aliases()
+        aliases = get_archive_aliases()
+        archive_options = [
+            {
+                'value': acronym,
+                'label': f"{acronym.upper()} -- {full_name}",
+            }
+            for acronym, full_name in sorted(aliases.items(), key=itemgetter(1))
+        ]
+        body = orjson.dumps({
+            'archives': archive_options,
+            'item_types': _ITEM_TYPES,
         })
-
-    item_types = [
-        'book', 'bookSection', 'conferencePaper', 'document',
-        'hearing', 'journalArticle', 'letter', 'manuscript',
-        'newspaperArticle', 'report', 'statute', 'thesis', 'webpage',
-    ]
-
-    return JSONResponse({
-        'archives': archive_options,
-        'item_types': item_types,
-    })
+        _filters_cache = (mtime, body)
+    return Response(body, media_type="application/json")
 
 
 @app.post("/api/chat")
@@ -236,23 +386,10 @@ async def chat(request: Request):
                 date_to=filter_vals.get('date_to') or None,
             )
 
-            client_sources = [_format_source_for_client(r) for r in results]
-            yield f"data: {json.dumps({'type': 'sources', 'sources': client_sources})}\n\n"
-
-            source_context = _build_source_context([
-                {
-                    'title': r['metadata'].get('title', ''),
-                    'authors': r['metadata'].get('authors', []),
-                    'date': r['metadata'].get('date', ''),
-                    'item_type': r['metadata'].get('item_type', ''),
-                    'archive': r['metadata'].get('archive', ''),
-                    'archive_location': r['metadata'].get('archive_location', ''),
-                    'page_start': r['metadata'].get('page_start', 0),
-                    'page_end': r['metadata'].get('page_end', 0),
-                    'text': r['metadata'].get('text', ''),
-                }
-                for r in results
-            ])
+            sources = [SourceView.from_result(r) for r in results]
+            yield _sse({'type': 'sources', 'sources': [s.to_client() for s in sources]})
+
+            source_context = _build_source_context(sources)
 
             messages = []
             for msg in prev_conversation:
@@ -264,53 +401,39 @@ async def chat(request: Request):
             user_content = f"{source_context}\n\nUser question: {message}"
             messages.append({'role': 'user', 'content': user_content})
 
-            for text in _get_llm_stream(messages, SYSTEM_PROMPT):
-                yield f"data: {json.dumps({'type': 'delta', 'text': text})}\n\n"
+            async for text in _coalesce(_get_llm_stream(messages, SYSTEM_PROMPT)):
+                yield _sse({'type': 'delta', 'text': text})
 
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            yield _SSE_DONE
 
         except Exception as e:
             logger.exception("Chat error")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield _sse({'type': 'error', 'message': str(e)})
 
     return StreamingResponse(generate(), media_type="text/event-stream")
 
 
+_OPENED_HTML = (b'<html><body><p>Opened in Zotero.</p>'
+                b'<script>window.close()</script></body></html>')
+
+
 @app.get("/zotero/pdf/{key}")
 async def open_pdf(key: str, page: int = 0):
     """Open a PDF in Zotero via zotero:// URL."""
     url = f"zotero://open-pdf/library/items/{key}"
     if page:
         url += f"?page={page}"
-    # macOS
-    if sys.platform == "darwin":
-        subprocess.Popen(['open', url])
-    # Linux
-    elif sys.platform.startswith("linux"):
-        subprocess.Popen(['xdg-open', url])
-    # Windows
-    elif sys.platform == "win32":
-        os.startfile(url)
-    return HTMLResponse(
-        '<html><body><p>Opened in Zotero.</p>'
-        '<script>window.close()</script></body></html>'
-    )
+    # Spawning is a blocking syscall; keep it off the event loop
+    await asyncio.to_thread(open_url, url)
+    return HTMLResponse(_OPENED_HTML)
 
 
 @app.get("/zotero/item/{key}")
 async def open_item(key: str):
     """Open a Zotero item via zotero:// URL."""
     url = f"zotero://select/library/items/{key}"
-    if sys.platform == "darwin":
-        subprocess.Popen(['open', url])
-    elif sys.platform.startswith("linux"):
-        subprocess.Popen(['xdg-open', url])
-    elif sys.platform == "win32":
-        os.startfile(url)
-    return HTMLResponse(
-        '<html><body><p>Opened in Zotero.</p>'
-        '<script>window.close()</script></body></html>'
-    )
+    await asyncio.to_thread(open_url, url)
+    return HTMLResponse(_OPENED_HTML)
 
 
 if __name__ == '__main__':